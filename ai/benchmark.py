@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Benchmark
+Times each stage of the classification hot path on a synthetic corpus,
+writes the results as JSON and compares them against a stored baseline.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from typing import Callable, Dict, List, Optional, Sequence
+
+from stage_metrics import PERCENTILES, percentile
+
+STAGES = ('preprocess_text', 'pattern_classify', 'ai_classify', 'combine_results')
+MESSAGE_SIZES = (200, 1000, 5000, 20000, 50000)
+MESSAGE_KINDS = ('clean', 'spam', 'phishing')
+
+# Metrics checked by compare(); throughput regresses when it drops
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+CLEAN_SENTENCES = [
+    "Hi team, the quarterly report is attached for review.",
+    "Could we move our meeting to Thursday afternoon?",
+    "Thanks for the quick turnaround on the contract draft.",
+    "Lunch is booked for noon in the main conference room.",
+    "Please send me the updated figures before Friday.",
+    "The deployment went well and monitoring looks normal.",
+]
+SPAM_SENTENCES = [
+    "LIMITED TIME OFFER!!! Buy now and save money on every order.",
+    "You are a WINNER of our million dollars lottery prize!",
+    "Free trial, no obligation, click here to subscribe today.",
+    "Make money fast from home with this amazing discount deal.",
+    "Order now!!! Diet pills and weight loss sale ends tonight.",
+]
+PHISHING_SENTENCES = [
+    "URGENT: your account suspended, verify now to avoid closure.",
+    "Dear customer, your password expired. Log in at http://secure-login.tk/reset",
+    "Your bank account is locked due to a billing issue, confirm your credit card.",
+    "Final notice: payment overdue. Visit http://192.168.12.7/pay immediately.",
+    "Security alert from paypa1: confirm your username and ssn today.",
+]
+SENTENCES = {'clean': CLEAN_SENTENCES, 'spam': SPAM_SENTENCES, 'phishing': PHISHING_SENTENCES}
+
+
+def generate_message(rng: random.Random, kind: str, size: int, html: bool) -> str:
+    """Build one message of roughly size characters."""
+    suspicious = SENTENCES[kind]
+    parts = []
+    length = 0
+    while length < size:
+        # Suspicious mail is mostly filler with a few tell-tale sentences
+        pool = suspicious if rng.random() < 0.3 else CLEAN_SENTENCES
+        sentence = rng.choice(pool)
+        if html:
+            sentence = (f'<p style="font-family:Arial;color:#333">{sentence}&nbsp;'
+                        f'<a href="http://example.com/{rng.randrange(10000)}">more</a></p>\n')
+        parts.append(sentence)
+        length += len(sentence) + 1
+    text = " ".join(parts)
+    if html:
+        text = f"<html><head><style>p {{ margin: 0 }}</style></head><body>{text}</body></html>"
+    return text
+
+
+def generate_corpus(count: int, seed: int = 0, sizes: Sequence[int] = MESSAGE_SIZES,
+                    html_ratio: float = 0.3) -> List[Dict]:
+    """Deterministic mix of clean/spam/phishing messages across sizes."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        kind = MESSAGE_KINDS[i % len(MESSAGE_KINDS)]
+        size = sizes[(i // len(MESSAGE_KINDS)) % len(sizes)]
+        html = rng.random() < html_ratio
+        corpus.append({
+            'kind': kind,
+            'size': size,
+            'html': html,
+            'text': generate_message(rng, kind, size, html)
+        })
+    return corpus
+
+
+def summarize(samples: Sequence[float]) -> Dict:
+    """Latency summary in milliseconds."""
+    summary = {f'p{pct}_ms': percentile(samples, pct) * 1000 for pct in PERCENTILES}
+    summary['mean_ms'] = sum(samples) / len(samples) * 1000 if samples else 0.0
+    return summary
+
+
+def timed(timings: Dict[str, List[float]], stage: str, func: Callable, *args):
+    """Call func(*args) and record its wall time under stage."""
+    start = time.perf_counter()
+    result = func(*args)
+    timings[stage].append(time.perf_counter() - start)
+    return result
+
+
+def run_benchmark(guardian, corpus: List[Dict], warmup: int = 10) -> Dict:
+    """Time every stage of classify_email for each corpus message."""
+    for item in corpus[:warmup]:
+        guardian.classify_email(item['text'])
+    
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES + ('total',)}
+    start_time = time.perf_counter()
+    for item in corpus:
+        message_start = time.perf_counter()
+        clean_text = timed(timings, 'preprocess_text', guardian.preprocess_text, item['text'])
+        pattern_result = timed(timings, 'pattern_classify', guardian.pattern_classify, clean_text)
+        ai_result = timed(timings, 'ai_classify', guardian.ai_classify, clean_text)
+        timed(timings, 'combine_results', guardian.combine_results, ai_result, pattern_result)
+        timings['total'].append(time.perf_counter() - message_start)
+    elapsed = time.perf_counter() - start_time
+    
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'model': guardian.model_name if guardian.classifier else None,
+            'backend': guardian.active_backend,
+            'quantize': guardian.quantize,
+            'messages': len(corpus),
+            'bytes': sum(len(item['text']) for item in corpus),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'stages': {stage: summarize(timings[stage]) for stage in STAGES},
+        'total': summarize(timings['total']),
+        'messages_per_second': len(corpus) / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = 0.10) -> List[Dict]:
+    """Regressions of current against baseline beyond threshold (0.10 = 10%)."""
+    regressions = []
+    sections = dict(current['stages'], total=current['total'])
+    base_sections = dict(baseline.get('stages', {}), total=baseline.get('total', {}))
+    for name, metrics in sections.items():
+        for metric in LATENCY_METRICS:
+            base = base_sections.get(name, {}).get(metric)
+            if base and metrics[metric] > base * (1 + threshold):
+                regressions.append({
+                    'stage': name,
+                    'metric': metric,
+                    'baseline': base,
+                    'current': metrics[metric],
+                    'change': metrics[metric] / base - 1
+                })
+    
+    base_rate = baseline.get('messages_per_second')
+    if base_rate and current['messages_per_second'] < base_rate * (1 - threshold):
+        regressions.append({
+            'stage': 'total',
+            'metric': 'messages_per_second',
+            'baseline': base_rate,
+            'current': current['messages_per_second'],
+            'change': current['messages_per_second'] / base_rate - 1
+        })
+    return regressions
+
+
+def print_report(report: Dict, out=sys.stderr):
+    """Human-readable stage table."""
+    print(f"{'stage':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}", file=out)
+    for name, metrics in list(report['stages'].items()) + [('total', report['total'])]:
+        print(f"{name:<18}{metrics['p50_ms']:>10.3f}{metrics['p95_ms']:>10.3f}"
+              f"{metrics['p99_ms']:>10.3f}{metrics['mean_ms']:>10.3f}", file=out)
+    print(f"⚡ {report['messages_per_second']:.1f} messages/s over "
+          f"{report['meta']['messages']} messages", file=out)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """CLI for running and comparing benchmarks."""
+    from email_guard import EmailGuardian
+    
+    parser = argparse.ArgumentParser(description="Smart Email Guardian benchmark")
+    parser.add_argument("--messages", type=int, default=300, help="Corpus size")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed warm-up messages")
+    parser.add_argument("--patterns-only", action="store_true", help="Benchmark without the AI model")
+    parser.add_argument("--backend", choices=EmailGuardian.INFERENCE_BACKENDS, default="torch")
+    parser.add_argument("--quantize", choices=EmailGuardian.QUANTIZE_MODES, default="none")
+    parser.add_argument("--output", "-o", help="Write the JSON report to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown counted as a regression (default 0.10)")
+    args = parser.parse_args(argv)
+    
+    guardian = EmailGuardian(
+        model_loading='none' if args.patterns_only else 'eager',
+        inference_backend=args.backend,
+        quantize=args.quantize
+    )
+    corpus = generate_corpus(args.messages, args.seed)
+    report = run_benchmark(guardian, corpus, args.warmup)
+    print_report(report)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for key in ('model', 'backend', 'quantize'):
+            if baseline.get('meta', {}).get(key) != report['meta'][key]:
+                print(f"⚠️  Baseline {key} differs: {baseline.get('meta', {}).get(key)} "
+                      f"vs {report['meta'][key]}", file=sys.stderr)
+        regressions = compare(report, baseline, args.threshold)
+        for regression in regressions:
+            print(f"🐢 {regression['stage']} {regression['metric']}: "
+                  f"{regression['baseline']:.3f} -> {regression['current']:.3f} "
+                  f"({regression['change']:+.1%})", file=sys.stderr)
+        if regressions:
+            return 1
+        print("✅ No regressions against the baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
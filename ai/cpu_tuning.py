@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - CPU Tuning
+Thread-pool and CPU-affinity settings for CPU inference, and an auto-tune
+command that measures throughput of worker/thread combinations on the
+current machine.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Native thread pools that size themselves from these at import time
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS')
+
+# Lock files of claimed worker slots, held open for the process lifetime
+_held_slots = []
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def cpu_ids() -> List[int]:
+    """Sorted ids of the CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Parse a CPU list such as '0-3,8,10-11' into sorted ids."""
+    cpus = set()
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition('-')
+        try:
+            low = int(first)
+            high = int(last) if last else low
+        except ValueError:
+            raise ValueError(f"Invalid CPU list: {spec!r}") from None
+        if low < 0 or high < low:
+            raise ValueError(f"Invalid CPU range: {item!r}")
+        cpus.update(range(low, high + 1))
+    if not cpus:
+        raise ValueError(f"Empty CPU list: {spec!r}")
+    return sorted(cpus)
+
+
+def worker_cpus(index: int, workers: int, cpus: Sequence[int]) -> List[int]:
+    """Disjoint slice of cpus for worker index out of workers.
+    
+    With more workers than CPUs, workers share single CPUs round-robin.
+    """
+    cpus = list(cpus)
+    share = len(cpus) // workers
+    if share == 0:
+        return [cpus[index % len(cpus)]]
+    return cpus[index * share:(index + 1) * share]
+
+
+def set_cpu_affinity(cpus: Iterable[int]) -> bool:
+    """Pin this process to cpus; False where the platform cannot."""
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, set(cpus))
+    return True
+
+
+def claim_worker_slot(workers: int, group: str, lock_dir: Optional[str] = None) -> Optional[int]:
+    """Claim the lowest free worker index (0..workers-1) within group.
+    
+    Sibling processes (e.g. uvicorn workers) call this to tell themselves
+    apart. Each slot is an exclusive lock on a file in lock_dir, released
+    by the OS when its process exits, so a restarted worker takes over the
+    slot of the one it replaces. Returns None if every slot is taken or the
+    platform has no flock.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    
+    lock_dir = lock_dir or tempfile.gettempdir()
+    for index in range(workers):
+        handle = open(os.path.join(lock_dir, f"{group}-slot-{index}.lock"), 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _held_slots.append(handle)
+        return index
+    return None
+
+
+def thread_environment(intra_op_threads: int):
+    """Size OpenMP/MKL pools for processes that have not loaded torch yet.
+    
+    Explicit values already in the environment are kept.
+    """
+    if intra_op_threads > 0:
+        for name in THREAD_ENV_VARS:
+            os.environ.setdefault(name, str(intra_op_threads))
+
+
+def configure_torch_threads(torch, intra_op_threads: int = 0, inter_op_threads: int = 0) -> bool:
+    """Apply torch thread counts (0 keeps torch's default).
+    
+    Returns False if the inter-op count could not be changed because torch
+    already started its inter-op pool in this process.
+    """
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0 and torch.get_num_interop_threads() != inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            return False
+    return True
+
+
+def candidate_settings(cpus: int, max_workers: Optional[int] = None,
+                       inter_op: Sequence[int] = (1,)) -> List[Tuple[int, int, int]]:
+    """(workers, intra-op, inter-op) combinations that never oversubscribe.
+    
+    Worker and thread counts are powers of two plus cpus itself, with
+    workers * intra-op threads <= cpus.
+    """
+    def counts(limit: int) -> List[int]:
+        values = {limit}
+        value = 1
+        while value < limit:
+            values.add(value)
+            value *= 2
+        return sorted(values)
+    
+    settings = []
+    for workers in counts(min(max_workers or cpus, cpus)):
+        for threads in counts(cpus // workers):
+            for inter in inter_op:
+                settings.append((workers, threads, inter))
+    return settings
+
+
+def _trial_worker(options: Dict, texts: List[str], batch_size: int,
+                  cpus: Optional[List[int]], barrier, results):
+    """Load a guardian with one setting, then time a corpus pass after the barrier."""
+    try:
+        from email_guard import EmailGuardian
+        
+        guardian = EmailGuardian(cpu_affinity=cpus, **options)
+        guardian.classify_batch(texts[:batch_size], batch_size)  # warm-up
+        barrier.wait()
+        start = time.perf_counter()
+        guardian.classify_batch(texts, batch_size)
+        results.put(time.perf_counter() - start)
+    except Exception as e:
+        barrier.abort()
+        results.put(f"{type(e).__name__}: {e}")
+
+
+def run_trial(options: Dict, texts: List[str], workers: int, intra_op_threads: int,
+              inter_op_threads: int, batch_size: int = 16, pin: bool = False,
+              timeout: float = 900.0) -> Dict:
+    """Throughput of workers independent processes classifying texts each.
+    
+    Every trial starts fresh processes: torch fixes its inter-op pool on
+    first use, so settings cannot be changed within one process.
+    """
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    options = dict(options, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    all_cpus = cpu_ids()
+    
+    processes = [
+        context.Process(
+            target=_trial_worker,
+            args=(options, texts, batch_size, worker_cpus(i, workers, all_cpus) if pin else None,
+                  barrier, results),
+            daemon=True
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        outcomes = [results.get(timeout=timeout) for _ in processes]
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+    
+    trial = {
+        'workers': workers,
+        'intra_op_threads': intra_op_threads,
+        'inter_op_threads': inter_op_threads,
+        'pinned': pin
+    }
+    errors = [outcome for outcome in outcomes if isinstance(outcome, str)]
+    if errors:
+        trial['error'] = errors[0]
+        trial['messages_per_second'] = 0.0
+    else:
+        # Workers start together; the slowest one bounds the throughput
+        trial['messages_per_second'] = workers * len(texts) / max(outcomes)
+    return trial
+
+
+def autotune(options: Dict, texts: List[str], settings: Sequence[Tuple[int, int, int]],
+             batch_size: int = 16, pin: bool = False, trial=run_trial, out=sys.stderr) -> Dict:
+    """Run every setting and report the highest-throughput one."""
+    trials = []
+    for workers, intra, inter in settings:
+        result = trial(options, texts, workers, intra, inter, batch_size=batch_size, pin=pin)
+        trials.append(result)
+        status = result.get('error') or f"{result['messages_per_second']:.1f} messages/s"
+        print(f"workers={workers:<3} intra_op={intra:<3} inter_op={inter:<3} {status}", file=out)
+    
+    successful = [result for result in trials if 'error' not in result]
+    best = max(successful, key=lambda result: result['messages_per_second']) if successful else None
+    return {'cpus': available_cpus(), 'trials': trials, 'best': best}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """CLI measuring worker/thread settings on this machine."""
+    from benchmark import generate_corpus
+    from email_guard import EmailGuardian
+    
+    parser = argparse.ArgumentParser(description="Smart Email Guardian CPU auto-tune")
+    parser.add_argument("--messages", type=int, default=64, help="Messages classified per worker")
+    parser.add_argument("--batch-size", type=int, default=16, help="Messages per model call")
+    parser.add_argument("--max-workers", type=int, help="Largest worker count tried (default: all CPUs)")
+    parser.add_argument("--inter-op", default="1",
+                        help="Comma-separated inter-op thread counts to try (default 1)")
+    parser.add_argument("--pin", action="store_true", help="Pin each worker to its own CPUs")
+    parser.add_argument("--patterns-only", action="store_true", help="Tune without the AI model")
+    parser.add_argument("--backend", choices=EmailGuardian.INFERENCE_BACKENDS, default="torch")
+    parser.add_argument("--quantize", choices=EmailGuardian.QUANTIZE_MODES, default="none")
+    parser.add_argument("--output", "-o", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    
+    options = {
+        'model_loading': 'none' if args.patterns_only else 'eager',
+        'inference_backend': args.backend,
+        'quantize': args.quantize
+    }
+    texts = [item['text'] for item in generate_corpus(args.messages, sizes=(200, 1000, 5000))]
+    inter_op = [int(value) for value in args.inter_op.split(',')]
+    settings = candidate_settings(available_cpus(), args.max_workers, inter_op)
+    
+    report = autotune(options, texts, settings, args.batch_size, args.pin)
+    report['options'] = options
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    
+    best = report['best']
+    if best is None:
+        print("❌ Every setting failed", file=sys.stderr)
+        return 1
+    print(f"🏁 Best: {best['workers']} worker(s) x {best['intra_op_threads']} intra-op thread(s), "
+          f"{best['messages_per_second']:.1f} messages/s", file=sys.stderr)
+    pinning = f"EMAIL_GUARD_AFFINITY_WORKERS={best['workers']} " if best['pinned'] else ""
+    print(f"   EMAIL_GUARD_INTRA_OP_THREADS={best['intra_op_threads']} "
+          f"EMAIL_GUARD_INTER_OP_THREADS={best['inter_op_threads']} {pinning}"
+          f"uvicorn --workers {best['workers']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -4,249 +4,852 @@ Smart Email Guardian - AI Core Logic
 CPU-only email classification using HuggingFace transformers and pattern matching.
 """
 
-import re
 import json
 import time
-from typing import Dict, List, Optional
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 import argparse
+import sys
 from pathlib import Path
 
-try:
-    from transformers import pipeline
-    import torch
-except ImportError:
-    print("Error: transformers and torch not installed. Run: pip install transformers torch")
-    exit(1)
+from cpu_tuning import configure_torch_threads, parse_cpu_list, set_cpu_affinity, thread_environment
+from mime_parser import parse_raw_email
+from results import DENY_LIST_ID, LOOKALIKE_ID, AIResult, CombinedResult, PatternResult
+from rule_pack import RulePackWatcher, RuleSnapshot, compile_rule_pack
+from stage_metrics import StageTimer
+from text_normalizer import normalize_text, normalize_with_offsets
+from url_index import UrlIndex
+
+# transformers/torch take seconds to import, so they are loaded on first use
+pipeline = None
+torch = None
+
+
+def load_ml_dependencies():
+    """Import transformers and torch the first time the model is needed."""
+    global pipeline, torch
+    try:
+        if pipeline is None:
+            from transformers import pipeline as hf_pipeline
+            pipeline = hf_pipeline
+        if torch is None:
+            import torch as torch_module
+            torch = torch_module
+    except ImportError as e:
+        raise ImportError(
+            "transformers and torch not installed. Run: pip install transformers torch"
+        ) from e
+
+
+class ResultCache:
+    """Thread-safe LRU cache of classification results with TTL expiry."""
+    
+    def __init__(self, max_size: int = 10000, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: str) -> Optional[CombinedResult]:
+        """Return the cached result for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key: str, result: CombinedResult):
+        """Store a result, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """Drop every cached result."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
 
 
 class EmailGuardian:
     """AI-powered email classification system."""
     
-    def __init__(self, model_name: str = "martin-ha/toxic-comment-model"):
-        """Initialize the email guardian with AI model."""
+    # Long-text handling modes for ai_classify
+    LONG_TEXT_MODES = ('truncate', 'window')
+    WINDOW_AGGREGATIONS = ('max', 'mean')
+    
+    # eager: load before returning; background: load on a thread while
+    # pattern-only scoring serves requests; none: pattern-only, no torch
+    MODEL_LOADING_MODES = ('eager', 'background', 'none')
+    
+    # torch: HuggingFace pipeline; onnx: exported graph on ONNX Runtime,
+    # falling back to torch if the export or runtime is unavailable
+    INFERENCE_BACKENDS = ('torch', 'onnx')
+    
+    # int8: dynamic quantization of the linear layers, cached on disk
+    QUANTIZE_MODES = ('none', 'int8')
+    
+    # combine_results weights and risk thresholds
+    AI_WEIGHT = 0.7
+    PATTERN_WEIGHT = 0.3
+    HIGH_RISK_THRESHOLD = 0.7
+    MEDIUM_RISK_THRESHOLD = 0.5
+    
+    # Possible AI confidences: the top-label score of a two-class model
+    AI_CONFIDENCE_RANGE = (0.5, 1.0)
+    
+    # Rule hits at which the cascade trusts the patterns without the model
+    CASCADE_MIN_MATCHES = 3
+    
+    # Parts of a raw message scanned separately by classify_raw_email
+    MESSAGE_PARTS = ('text', 'urls', 'attachments', 'senders')
+    
+    def __init__(self, model_name: str = "martin-ha/toxic-comment-model",
+                 long_text: str = 'truncate', window_aggregation: str = 'max',
+                 max_windows: int = 8, window_overlap: int = 64,
+                 cache_size: int = 0, cache_ttl: float = 3600.0,
+                 model_loading: str = 'eager', inference_backend: str = 'torch',
+                 quantize: str = 'none', cascade: bool = False,
+                 cascade_min_matches: int = CASCADE_MIN_MATCHES,
+                 deny_domains_file: Optional[str] = None,
+                 allow_domains_file: Optional[str] = None,
+                 brand_domains_file: Optional[str] = None,
+                 stage_timings: bool = False,
+                 intra_op_threads: int = 0, inter_op_threads: int = 0,
+                 cpu_affinity: Optional[Union[str, Iterable[int]]] = None,
+                 rule_pack_file: Optional[str] = None, rule_reload_interval: float = 0.0):
+        """Initialize the email guardian with AI model.
+        
+        long_text='window' scores the whole email in overlapping token
+        windows (at most max_windows, sharing window_overlap tokens) and
+        combines them with window_aggregation; 'truncate' keeps the
+        original 512-character prefix behaviour.
+        
+        cache_size > 0 enables an in-process result cache for repeated
+        bodies, with entries expiring after cache_ttl seconds.
+        
+        model_loading='background' returns immediately and loads the model
+        on a thread; until model_ready is set, emails are scored with
+        patterns only.
+        
+        inference_backend='onnx' runs the model with ONNX Runtime, exporting
+        it to the on-disk ONNX cache on first use.
+        
+        quantize='int8' applies dynamic int8 quantization to the model's
+        linear layers (or to the ONNX graph) and caches the result.
+        
+        cascade=True runs the patterns first and skips the model when they
+        decide the result: cascade_min_matches or more rule hits (0
+        disables this), or a pattern confidence that no AI score could move
+        across a risk threshold.
+        
+        deny_domains_file/allow_domains_file are local domain lists (one per
+        line) checked against every URL host and sender domain.
+        brand_domains_file replaces the built-in list of protected brand
+        domains used for lookalike detection.
+        
+        stage_timings=True adds a 'stage_timings' dict (seconds per stage)
+        to every result. Hooks added with add_timing_hook receive the same
+        breakdown whether or not it is included in results.
+        
+        intra_op_threads/inter_op_threads size the torch (or ONNX Runtime)
+        thread pools; 0 keeps the library default of one thread per core,
+        which oversubscribes the machine when several workers share it.
+        cpu_affinity ('0-3,8' or an iterable of CPU ids) pins the process.
+        
+        rule_pack_file is a JSON or YAML rule pack replacing the built-in
+        rules; with rule_reload_interval > 0 the file is polled and a
+        changed pack is compiled in the background and swapped in.
+        """
+        if long_text not in self.LONG_TEXT_MODES:
+            raise ValueError(f"long_text must be one of {self.LONG_TEXT_MODES}")
+        if window_aggregation not in self.WINDOW_AGGREGATIONS:
+            raise ValueError(f"window_aggregation must be one of {self.WINDOW_AGGREGATIONS}")
+        if max_windows < 1:
+            raise ValueError("max_windows must be at least 1")
+        if model_loading not in self.MODEL_LOADING_MODES:
+            raise ValueError(f"model_loading must be one of {self.MODEL_LOADING_MODES}")
+        if inference_backend not in self.INFERENCE_BACKENDS:
+            raise ValueError(f"inference_backend must be one of {self.INFERENCE_BACKENDS}")
+        if quantize not in self.QUANTIZE_MODES:
+            raise ValueError(f"quantize must be one of {self.QUANTIZE_MODES}")
+        if intra_op_threads < 0 or inter_op_threads < 0:
+            raise ValueError("thread counts must be non-negative")
+        if cascade_min_matches < 0:
+            raise ValueError("cascade_min_matches must be non-negative")
+        
         self.model_name = model_name
+        self.long_text = long_text
+        self.window_aggregation = window_aggregation
+        self.max_windows = max_windows
+        self.window_overlap = window_overlap
+        self.cache = ResultCache(cache_size, cache_ttl) if cache_size > 0 else None
         self.classifier = None
-        self.load_model()
+        self.inference_backend = inference_backend
+        self.active_backend = None
+        self.quantize = quantize
+        self.cascade = cascade
+        self.cascade_min_matches = cascade_min_matches
+        self.model_loading = model_loading
+        self.model_ready = threading.Event()
+        self.stage_timings = stage_timings
+        self.timing_hooks: List[Callable[[Dict[str, float], Dict], None]] = []
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        if isinstance(cpu_affinity, str):
+            cpu_affinity = parse_cpu_list(cpu_affinity)
+        self.cpu_affinity = sorted(cpu_affinity) if cpu_affinity else None
+        self.apply_cpu_settings()
+        self.url_index = UrlIndex.from_files(deny_domains_file, allow_domains_file, brand_domains_file)
+        self.rule_pack_file = rule_pack_file
         self.setup_patterns()
+        self.rule_watcher = None
+        if rule_pack_file and rule_reload_interval > 0:
+            self.rule_watcher = RulePackWatcher(rule_pack_file, self.swap_rules, rule_reload_interval).start()
+        
+        if model_loading == 'eager':
+            self.load_model()
+        elif model_loading == 'background':
+            self.start_background_load()
+        else:
+            self.model_ready.set()
+    
+    def apply_cpu_settings(self):
+        """Pin the process and size native thread pools before torch loads."""
+        if self.cpu_affinity and not set_cpu_affinity(self.cpu_affinity):
+            print("⚠️  CPU affinity is not supported on this platform; ignoring it")
+        thread_environment(self.intra_op_threads)
     
     def load_model(self):
         """Load the HuggingFace model for CPU inference."""
         try:
             print(f"🤖 Loading AI model: {self.model_name}")
-            self.classifier = pipeline(
-                "text-classification",
-                model=self.model_name,
-                device=-1  # Force CPU usage
-            )
-            print("✅ AI model loaded successfully")
+            if self.inference_backend == 'onnx':
+                self.classifier = self.load_onnx_classifier()
+            
+            if self.classifier is None:
+                load_ml_dependencies()
+                if not configure_torch_threads(torch, self.intra_op_threads, self.inter_op_threads):
+                    print("⚠️  torch inter-op threads were already started; keeping "
+                          f"{torch.get_num_interop_threads()}")
+                if self.quantize == 'int8':
+                    from model_quantization import load_quantized_pipeline
+                    self.classifier = load_quantized_pipeline(self.model_name)
+                else:
+                    self.classifier = pipeline(
+                        "text-classification",
+                        model=self.model_name,
+                        device=-1  # Force CPU usage
+                    )
+                self.active_backend = 'torch'
+            print(f"✅ AI model loaded successfully ({self.active_backend}, quantize={self.quantize})")
         except Exception as e:
             print(f"❌ Failed to load AI model: {e}")
             print("⚠️  Falling back to pattern-based detection only")
             self.classifier = None
+            self.active_backend = None
+        finally:
+            self.model_ready.set()
+    
+    def load_onnx_classifier(self):
+        """Build the ONNX Runtime classifier, or None to fall back to torch."""
+        try:
+            from onnx_backend import OnnxTextClassifier
+            classifier = OnnxTextClassifier(
+                self.model_name,
+                intra_op_threads=self.intra_op_threads,
+                inter_op_threads=self.inter_op_threads,
+                quantize=self.quantize
+            )
+            self.active_backend = 'onnx'
+            return classifier
+        except Exception as e:
+            print(f"⚠️  ONNX backend unavailable ({e}); using the torch pipeline")
+            return None
+    
+    def start_background_load(self) -> threading.Thread:
+        """Load the model on a daemon thread; patterns serve until it is ready."""
+        self.model_ready.clear()
+        thread = threading.Thread(target=self.load_model, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+    
+    @property
+    def model_status(self) -> str:
+        """One of 'loading', 'loaded' or 'unavailable'."""
+        if not self.model_ready.is_set():
+            return 'loading'
+        return 'loaded' if self.classifier is not None else 'unavailable'
     
     def setup_patterns(self):
-        """Setup regex patterns for phishing/spam detection."""
-        self.phishing_patterns = [
-            # Urgency patterns
-            r'\b(urgent|immediate|action required|account suspended|verify now)\b',
-            r'\b(limited time|expires soon|last chance|final notice)\b',
-            
-            # Financial threats
-            r'\b(account locked|payment overdue|billing issue|refund pending)\b',
-            r'\b(credit card|bank account|social security|password expired)\b',
-            
-            # Suspicious URLs
-            r'https?://[^\s]*\.(tk|ml|ga|cf|gq|xyz|top|club|online|site)\b',
-            r'https?://[^\s]*\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b',
-            
-            # Suspicious domains
-            r'\b(amaz0n|paypa1|goog1e|faceb00k|app1e|micr0soft)\b',
-            
-            # Personal information requests
-            r'\b(password|username|ssn|credit card|bank account|mother maiden)\b',
-            
-            # Suspicious attachments
-            r'\b\.(exe|bat|scr|pif|com|vbs|js|jar)\b',
-            
-            # Generic greetings
-            r'\b(dear user|dear customer|dear sir|dear madam)\b',
-            
-            # Suspicious sender patterns
-            r'from:\s*[^\s]*@[^\s]*\.(tk|ml|ga|cf|gq|xyz|top|club|online|site)',
-        ]
-        
-        self.spam_patterns = [
-            # Marketing keywords
-            r'\b(free|discount|offer|limited|sale|deal|save money)\b',
-            r'\b(click here|buy now|order now|subscribe|unsubscribe)\b',
-            
-            # Suspicious subject patterns
-            r'\b(viagra|cialis|weight loss|diet pills|make money fast)\b',
-            r'\b(winner|prize|lottery|inheritance|million dollars)\b',
-            
-            # Multiple exclamation marks
-            r'!{2,}',
-            
-            # All caps words
-            r'\b[A-Z]{4,}\b',
-            
-            # Suspicious links
-            r'\[click here\]|\[here\]|\[link\]',
-        ]
+        """Compile the rule pack (or the built-in rules) for detection."""
+        self.rules = compile_rule_pack(self.rule_pack_file)
+    
+    def swap_rules(self, snapshot: RuleSnapshot):
+        """Make snapshot the active rule set.
+        
+        A single reference assignment: messages already being scored
+        finish with the snapshot they started with.
+        """
+        self.rules = snapshot
+        print(f"🔁 Rule pack {snapshot.version} active ({len(snapshot.rule_ids)} rules)")
+    
+    def reload_rules(self) -> str:
+        """Recompile the rule pack file now and return the new version.
+        
+        Raises RulePackError, keeping the current rules, if it fails.
+        """
+        self.swap_rules(compile_rule_pack(self.rule_pack_file))
+        return self.rules.version
+    
+    @property
+    def rule_engine(self):
+        """Compiled matcher of the active rule set."""
+        return self.rules.engine
+    
+    @property
+    def phishing_patterns(self) -> List[str]:
+        return self.rules.patterns('phishing')
+    
+    @property
+    def spam_patterns(self) -> List[str]:
+        return self.rules.patterns('spam')
     
     def classify_email(self, email_text: str) -> Dict:
         """Classify email content using AI and pattern matching."""
-        start_time = time.time()
+        timer = StageTimer()
         
         # Clean and prepare text
         clean_text = self.preprocess_text(email_text)
+        timer.lap('preprocess')
         
-        # AI classification
-        ai_result = self.ai_classify(clean_text)
+        return self.classify_prepared(clean_text, timer)
+    
+    def classify_raw_email(self, raw_message: Union[str, bytes]) -> Dict:
+        """Classify a raw RFC 822 message part by part.
+        
+        Only the subject and one preferred text body reach the text rules
+        and the model; URL, attachment and sender rules see just the link
+        targets, attachment filenames and sender addresses. Attachment
+        payloads and duplicate alternatives are never scanned.
+        """
+        timer = StageTimer()
+        
+        parsed = parse_raw_email(raw_message)
+        timer.lap('parse')
+        clean_text, parts = self.prepare_parts(parsed)
+        timer.lap('preprocess')
+        
+        return self.classify_prepared(clean_text, timer, parts)
+    
+    def prepare_parts(self, parsed: Dict) -> Tuple[str, Dict[str, str]]:
+        """Preprocessed text and per-scope parts of a parse_raw_email result."""
+        clean_text = self.preprocess_text(parsed['text'])
+        parts = {
+            'text': clean_text,
+            'urls': "\n".join(parsed['urls']),
+            'attachments': "\n".join(parsed['attachments']),
+            'senders': "\n".join(f"from: {address}" for _, address in parsed['senders'])
+        }
+        return clean_text, parts
+    
+    def classify_prepared(self, clean_text: str, timer: StageTimer,
+                          parts: Optional[Dict[str, str]] = None) -> Dict:
+        """Score preprocessed text, or the parts of a parsed raw message."""
+        # Repeated campaign bodies skip straight to the cached verdict
+        if self.cache is not None:
+            cache_key = self.prepared_cache_key(clean_text, parts)
+            cached = self.cache.get(cache_key)
+            timer.lap('cache')
+            if cached is not None:
+                return self.build_result(cached, timer.elapsed(), timer.stages)
         
         # Pattern-based detection
-        pattern_result = self.pattern_classify(clean_text)
+        if parts is None:
+            pattern_result = self.pattern_classify(clean_text)
+        else:
+            pattern_result = self.pattern_classify_parts(parts)
+        timer.lap('patterns')
+        
+        # AI classification, unless the patterns already decide the outcome
+        if self.cascade and self.classifier and self.is_decisive(pattern_result):
+            ai_result = self.skipped_ai_result()
+        else:
+            ai_result = self.ai_classify(clean_text, timer)
+        timer.lap('ai')
         
         # Combine results
         final_result = self.combine_results(ai_result, pattern_result)
         
-        # Calculate processing time
-        processing_time = time.time() - start_time
+        if self.cache is not None:
+            self.cache.put(cache_key, final_result)
+        timer.lap('combine')
+        
+        return self.build_result(final_result, timer.elapsed(), timer.stages)
+    
+    def classify_batch(self, texts: List[str], batch_size: int = 32) -> List[Dict]:
+        """Classify many emails, batching the AI model calls."""
+        timer = StageTimer()
+        
+        clean_texts = [self.preprocess_text(text) for text in texts]
+        timer.lap('preprocess')
+        
+        return self.classify_prepared_batch(clean_texts, timer, batch_size=batch_size)
+    
+    def classify_raw_batch(self, raw_messages: List[Union[str, bytes]], batch_size: int = 32) -> List[Dict]:
+        """Classify many raw RFC 822 messages, batching the AI model calls.
+        
+        Each message's parts are pattern-matched as in classify_raw_email;
+        only the subject and body texts are batched through the model.
+        """
+        timer = StageTimer()
+        
+        parsed = [parse_raw_email(raw_message) for raw_message in raw_messages]
+        timer.lap('parse')
+        prepared = [self.prepare_parts(message) for message in parsed]
+        timer.lap('preprocess')
+        
+        return self.classify_prepared_batch([clean_text for clean_text, _ in prepared], timer,
+                                            [parts for _, parts in prepared], batch_size)
+    
+    def classify_prepared_batch(self, clean_texts: List[str], timer: StageTimer,
+                                parts_list: Optional[List[Dict[str, str]]] = None,
+                                batch_size: int = 32) -> List[Dict]:
+        """Score preprocessed texts, or parsed messages' parts, in batches."""
+        final_results: List[Optional[CombinedResult]] = [None] * len(clean_texts)
+        
+        # Serve cached verdicts first; only misses reach the model
+        cache_keys = []
+        if self.cache is not None:
+            cache_keys = [
+                self.prepared_cache_key(text, parts_list[i] if parts_list is not None else None)
+                for i, text in enumerate(clean_texts)
+            ]
+            for i, key in enumerate(cache_keys):
+                final_results[i] = self.cache.get(key)
+            timer.lap('cache')
+        pending = [i for i, result in enumerate(final_results) if result is None]
         
-        return {
-            'classification': final_result['classification'],
-            'confidence': final_result['confidence'],
-            'explanation': final_result['explanation'],
-            'risk_level': final_result['risk_level'],
-            'suspicious_patterns': final_result['patterns'],
+        # Pattern-scan every remaining text (or message's parts) up front
+        if parts_list is None:
+            pattern_results = [self.pattern_classify(clean_texts[i]) for i in pending]
+        else:
+            pattern_results = [self.pattern_classify_parts(parts_list[i]) for i in pending]
+        timer.lap('patterns')
+        
+        # Only texts the patterns leave undecided reach the model
+        ai_results: List[Optional[AIResult]] = [None] * len(pending)
+        undecided = []
+        for j, pattern_result in enumerate(pattern_results):
+            if self.cascade and self.classifier and self.is_decisive(pattern_result):
+                ai_results[j] = self.skipped_ai_result()
+            else:
+                undecided.append(j)
+        
+        # AI classification in length-sorted batches
+        batch_results = self.ai_classify_batch([clean_texts[pending[j]] for j in undecided], batch_size)
+        for j, ai_result in zip(undecided, batch_results):
+            ai_results[j] = ai_result
+        timer.lap('ai')
+        
+        for i, ai_result, pattern_result in zip(pending, ai_results, pattern_results):
+            final_results[i] = self.combine_results(ai_result, pattern_result)
+            if self.cache is not None:
+                self.cache.put(cache_keys[i], final_results[i])
+        timer.lap('combine')
+        
+        # Amortize the batch time over its messages
+        count = max(len(clean_texts), 1)
+        processing_time = timer.elapsed() / count
+        stage_timings = {stage: seconds / count for stage, seconds in timer.stages.items()}
+        
+        return [self.build_result(result, processing_time, stage_timings) for result in final_results]
+    
+    def build_result(self, final_result: CombinedResult, processing_time: float,
+                     stage_timings: Optional[Dict[str, float]] = None) -> Dict:
+        """Shape a combined result into the public result dict.
+        
+        Rule descriptions are only looked up here. Timing hooks are
+        notified here too, once per result.
+        """
+        result = {
+            'classification': final_result.classification,
+            'confidence': final_result.confidence,
+            'explanation': final_result.explanation,
+            'risk_level': final_result.risk_level,
+            'suspicious_patterns': final_result.patterns,
+            'rule_ids': list(final_result.rule_ids),
+            'url_results': list(final_result.url_results),
+            'analysis_path': final_result.analysis_path,
+            'rule_pack_version': final_result.rule_pack_version,
             'processing_time': processing_time
         }
+        if stage_timings is not None:
+            if self.stage_timings:
+                result['stage_timings'] = dict(stage_timings)
+            self.notify_timings(stage_timings, result)
+        return result
     
-    def preprocess_text(self, text: str) -> str:
-        """Clean and normalize text for analysis."""
-        # Remove HTML tags
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
+    def add_timing_hook(self, hook: Callable[[Dict[str, float], Dict], None]):
+        """Call hook(stage_timings, result) after every classification.
         
-        # Convert to lowercase
-        text = text.lower()
+        stage_timings maps stage names (parse, preprocess, cache,
+        patterns, tokenize, ai, combine; only the stages that ran) to
+        seconds. Hooks run synchronously on the classifying thread, so
+        they should only record the numbers.
+        """
+        self.timing_hooks.append(hook)
+    
+    def remove_timing_hook(self, hook: Callable[[Dict[str, float], Dict], None]):
+        """Stop calling a hook added with add_timing_hook."""
+        self.timing_hooks.remove(hook)
+    
+    def notify_timings(self, stage_timings: Dict[str, float], result: Dict):
+        """Pass one result's stage timings to every hook."""
+        for hook in self.timing_hooks:
+            try:
+                hook(stage_timings, result)
+            except Exception as e:
+                # A broken metrics sink must not fail the classification
+                print(f"⚠️  Timing hook failed: {e}")
+    
+    def prepared_cache_key(self, clean_text: str, parts: Optional[Dict[str, str]] = None) -> str:
+        """Cache key of preprocessed text, or of all parts of a raw message."""
+        if parts is None:
+            return self.cache_key(clean_text)
+        return self.cache_key("\0".join(parts[scope] for scope in self.MESSAGE_PARTS))
+    
+    def cache_key(self, clean_text: str) -> str:
+        """Hash preprocessed text together with the model and rule-set version."""
+        model_version = (
+            f"{self.model_name}:{self.active_backend}:{self.quantize}:{self.long_text}:"
+            f"{self.window_aggregation}:{self.max_windows}:{self.window_overlap}"
+            if self.classifier else 'pattern-only'
+        )
+        digest = hashlib.sha256()
+        for part in (model_version, self.rules.engine.version, clean_text):
+            digest.update(part.encode('utf-8', 'surrogatepass'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def preprocess_text(self, text: str, with_offsets: bool = False):
+        """Clean and normalize text for analysis.
         
-        return text.strip()
+        Strips tags (with <script>/<style> bodies), decodes entities,
+        lowercases and collapses whitespace. with_offsets=True returns
+        (text, offsets) where offsets[i] is the position in the original
+        text of normalized character i.
+        """
+        if with_offsets:
+            return normalize_with_offsets(text)
+        return normalize_text(text)
     
-    def ai_classify(self, text: str) -> Dict:
-        """Classify text using AI model."""
+    def ai_classify(self, text: str, timer: Optional[StageTimer] = None) -> AIResult:
+        """Classify text using AI model.
+        
+        With a timer, windowed mode charges tokenization to its own
+        'tokenize' stage.
+        """
         if not self.classifier:
-            return {
-                'classification': 'unknown',
-                'confidence': 0.5,
-                'explanation': 'AI model not available'
-            }
+            return AIResult('unknown', 0.5, 'AI model not available')
         
         try:
-            result = self.classifier(text[:512])  # Limit text length
+            if self.long_text == 'window':
+                return self.map_ai_output(self.classify_windows(text, timer))
             
-            # Map toxic classification to our categories
-            if result[0]['label'] == 'toxic':
-                return {
-                    'classification': 'suspicious',
-                    'confidence': result[0]['score'],
-                    'explanation': 'AI detected potentially harmful content'
-                }
-            else:
-                return {
-                    'classification': 'safe',
-                    'confidence': result[0]['score'],
-                    'explanation': 'AI classified content as safe'
-                }
+            result = self.classifier(text[:512])  # Limit text length
+            return self.map_ai_output(result[0])
         except Exception as e:
-            return {
-                'classification': 'unknown',
-                'confidence': 0.5,
-                'explanation': f'AI classification failed: {str(e)}'
-            }
+            return self.ai_failure(e)
     
-    def pattern_classify(self, text: str) -> Dict:
-        """Classify text using pattern matching."""
-        suspicious_patterns = []
+    def classify_windows(self, text: str, timer: Optional[StageTimer] = None) -> Dict:
+        """Score text in overlapping token windows with one forward pass.
+        
+        The text is tokenized once into windows of the model's maximum
+        length. When there are more than max_windows, an evenly spaced
+        subset is kept so the whole email is still sampled while the
+        batch size, and therefore latency, stays bounded.
+        """
+        tokenizer = self.classifier.tokenizer
+        is_onnx = self.active_backend == 'onnx'
+        
+        # Some tokenizers report a huge sentinel instead of a real limit
+        max_length = min(tokenizer.model_max_length, 512)
+        stride = min(self.window_overlap, max_length // 2)
+        
+        encoded = tokenizer(
+            text,
+            truncation=True,
+            max_length=max_length,
+            stride=stride,
+            return_overflowing_tokens=True,
+            padding=True,
+            return_tensors='np' if is_onnx else 'pt'
+        )
+        if timer is not None:
+            timer.lap('tokenize')
+        
+        count = encoded['input_ids'].shape[0]
+        if count > self.max_windows:
+            step = (count - 1) / (self.max_windows - 1) if self.max_windows > 1 else 0
+            keep = sorted({round(i * step) for i in range(self.max_windows)})
+        else:
+            keep = list(range(count))
+        
+        inputs = {
+            key: encoded[key][keep]
+            for key in tokenizer.model_input_names
+            if key in encoded
+        }
+        
+        if is_onnx:
+            from onnx_backend import softmax
+            probabilities = softmax(self.classifier.logits(inputs))
+            id2label = self.classifier.config.id2label
+        else:
+            model = self.classifier.model
+            with torch.no_grad():
+                probabilities = torch.softmax(model(**inputs).logits, dim=-1)
+            id2label = model.config.id2label
+        
+        toxic_scores = probabilities[:, self.toxic_label_index(id2label)]
+        if self.window_aggregation == 'max':
+            toxic_score = float(toxic_scores.max())
+        else:
+            toxic_score = float(toxic_scores.mean())
+        
+        # Report it the way the pipeline reports its top label
+        if toxic_score >= 0.5:
+            return {'label': 'toxic', 'score': toxic_score}
+        return {'label': 'non-toxic', 'score': 1.0 - toxic_score}
+    
+    @staticmethod
+    def toxic_label_index(id2label: Dict) -> int:
+        """Find the output index of the toxic label."""
+        for index, label in id2label.items():
+            if str(label).lower() == 'toxic':
+                return int(index)
+        return 1
+    
+    def ai_classify_batch(self, texts: List[str], batch_size: int = 32) -> List[AIResult]:
+        """Classify many texts with padded, length-sorted model batches."""
+        if not self.classifier or self.long_text == 'window':
+            # Windowed mode already batches the windows of each text
+            return [self.ai_classify(text) for text in texts]
+        
+        inputs = [text[:512] for text in texts]  # Limit text length
+        
+        # Sorting by length keeps padding inside each batch to a minimum
+        order = sorted(range(len(inputs)), key=lambda i: len(inputs[i]))
+        results: List[Optional[AIResult]] = [None] * len(inputs)
         
-        # Check phishing patterns
-        for pattern in self.phishing_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                suspicious_patterns.append(f"Phishing pattern: {pattern}")
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            try:
+                outputs = self.classifier(
+                    [inputs[i] for i in chunk],
+                    batch_size=len(chunk)
+                )
+                for i, output in zip(chunk, outputs):
+                    results[i] = self.map_ai_output(output)
+            except Exception as e:
+                for i in chunk:
+                    results[i] = self.ai_failure(e)
+        
+        return results
+    
+    def map_ai_output(self, output: Dict) -> AIResult:
+        """Map a toxic/non-toxic model prediction to our categories."""
+        if output['label'] == 'toxic':
+            return AIResult('suspicious', output['score'], 'AI detected potentially harmful content')
+        else:
+            return AIResult('safe', output['score'], 'AI classified content as safe')
+    
+    def ai_failure(self, error: Exception) -> AIResult:
+        """Result used when model inference raises."""
+        return AIResult('unknown', 0.5, f'AI classification failed: {str(error)}')
+    
+    def pattern_classify(self, text: str) -> PatternResult:
+        """Classify text using pattern matching."""
+        rules = self.rules
+        # Check phishing and spam patterns in one scan
+        matched = set(rules.engine.match(text, rules.text_rules))
+        return self.pattern_result(matched, *self.url_findings(text, text), rules)
+    
+    def pattern_classify_parts(self, parts: Dict[str, str]) -> PatternResult:
+        """Pattern-match each message part against the rules scoped to it."""
+        rules = self.rules
+        matched = set()
+        for scope, indices in rules.rule_scopes.items():
+            if parts.get(scope):
+                matched.update(rules.engine.match(parts[scope], indices))
+        return self.pattern_result(matched, *self.url_findings(parts['urls'], parts['senders']), rules)
+    
+    def url_findings(self, url_text: str, sender_text: str) -> Tuple[List[Dict], List[Dict]]:
+        """Check every URL and sender domain once against the URL index."""
+        return self.url_index.analyze_urls(url_text), self.url_index.analyze_senders(sender_text)
+    
+    def pattern_result(self, matched: Set[int], url_results: List[Dict], sender_results: List[Dict],
+                       rules: RuleSnapshot) -> PatternResult:
+        """Turn matched rules and URL findings into a pattern verdict."""
+        # A rule pack may leave out any of the URL index checks
+        url_rules = rules.url_rules
+        if 'suspicious_tld' in url_rules and any(result['suspicious_tld'] for result in url_results):
+            matched.add(url_rules['suspicious_tld'])
+        if 'ip_literal' in url_rules and any(result['ip_literal'] for result in url_results):
+            matched.add(url_rules['ip_literal'])
+        if 'sender_tld' in url_rules and any(result['suspicious_tld'] for result in sender_results):
+            matched.add(url_rules['sender_tld'])
         
-        # Check spam patterns
-        for pattern in self.spam_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                suspicious_patterns.append(f"Spam pattern: {pattern}")
+        rule_ids = [rules.rule_ids[i] for i in sorted(matched)]
+        findings = []
+        if url_results or sender_results:
+            hosts = {result['host']: result for result in url_results + sender_results}
+            for host, result in hosts.items():
+                if result['denied']:
+                    rule_ids.append(DENY_LIST_ID)
+                    findings.append(f"Phishing domain: {host} (deny-list)")
+            # Every lookalike host is listed, but they count as one match
+            lookalikes = [(host, result['lookalike_of']) for host, result in hosts.items()
+                          if result['lookalike_of']]
+            if lookalikes:
+                rule_ids.append(LOOKALIKE_ID)
+            for host, brand in lookalikes:
+                findings.append(f"Phishing domain: {host} (lookalike of {brand})")
         
+        classification, confidence, explanation = self.pattern_verdict(len(rule_ids))
+        return PatternResult(classification, confidence, explanation, tuple(rule_ids), findings,
+                             url_results, rules)
+    
+    def pattern_verdict(self, match_count: int) -> Tuple[str, float, str]:
+        """Map the number of matched patterns to a classification."""
         # Determine classification based on patterns
-        if len(suspicious_patterns) >= 3:
-            return {
-                'classification': 'suspicious',
-                'confidence': 0.8,
-                'explanation': f'Detected {len(suspicious_patterns)} suspicious patterns',
-                'patterns': suspicious_patterns
-            }
-        elif len(suspicious_patterns) >= 1:
-            return {
-                'classification': 'suspicious',
-                'confidence': 0.6,
-                'explanation': f'Detected {len(suspicious_patterns)} suspicious patterns',
-                'patterns': suspicious_patterns
-            }
+        if match_count >= 3:
+            return 'suspicious', 0.8, f'Detected {match_count} suspicious patterns'
+        elif match_count >= 1:
+            return 'suspicious', 0.6, f'Detected {match_count} suspicious patterns'
         else:
-            return {
-                'classification': 'safe',
-                'confidence': 0.7,
-                'explanation': 'No suspicious patterns detected',
-                'patterns': []
-            }
+            return 'safe', 0.7, 'No suspicious patterns detected'
+    
+    def risk_band(self, confidence: float) -> Tuple[str, str]:
+        """Map a combined confidence to (classification, risk_level)."""
+        if confidence >= self.HIGH_RISK_THRESHOLD:
+            return 'suspicious', 'high'
+        elif confidence >= self.MEDIUM_RISK_THRESHOLD:
+            return 'suspicious', 'medium'
+        else:
+            return 'safe', 'low'
+    
+    def is_decisive(self, pattern_result: PatternResult) -> bool:
+        """True if the cascade can report pattern_result without the model.
+        
+        Enough rule hits settle the result on their own. Otherwise the
+        patterns decide only when no possible AI score can change the risk
+        band, which needs a larger PATTERN_WEIGHT than the default.
+        """
+        if self.cascade_min_matches and len(pattern_result.get('rule_ids', ())) >= self.cascade_min_matches:
+            return True
+        low, high = self.AI_CONFIDENCE_RANGE
+        pattern_part = pattern_result['confidence'] * self.PATTERN_WEIGHT
+        return (
+            self.risk_band(low * self.AI_WEIGHT + pattern_part) ==
+            self.risk_band(high * self.AI_WEIGHT + pattern_part)
+        )
+    
+    def skipped_ai_result(self) -> AIResult:
+        """Stand-in AI result when the cascade skips inference.
+        
+        The midpoint of the AI confidence range places the combined
+        confidence in the middle of the band the patterns already fixed,
+        or scores a rule-hit decision as if the model were undecided.
+        """
+        low, high = self.AI_CONFIDENCE_RANGE
+        return AIResult('skipped', (low + high) / 2, 'AI inference skipped: pattern evidence is decisive',
+                        skipped=True)
     
-    def combine_results(self, ai_result: Dict, pattern_result: Dict) -> Dict:
+    def combine_results(self, ai_result: AIResult, pattern_result: PatternResult) -> CombinedResult:
         """Combine AI and pattern results."""
         # Weight AI results more heavily if available
-        if ai_result['classification'] != 'unknown':
-            ai_weight = 0.7
-            pattern_weight = 0.3
+        if ai_result.classification != 'unknown':
+            ai_weight = self.AI_WEIGHT
+            pattern_weight = self.PATTERN_WEIGHT
         else:
             ai_weight = 0.0
             pattern_weight = 1.0
         
+        # Record which stages actually produced the verdict
+        if ai_result.skipped:
+            analysis_path = 'cascade'
+        elif ai_result.classification != 'unknown':
+            analysis_path = 'ai+patterns'
+        else:
+            analysis_path = 'patterns'
+        
         # Calculate combined confidence
         combined_confidence = (
-            ai_result['confidence'] * ai_weight +
-            pattern_result['confidence'] * pattern_weight
+            ai_result.confidence * ai_weight +
+            pattern_result.confidence * pattern_weight
         )
         
         # Determine final classification
-        if combined_confidence >= 0.7:
-            classification = 'suspicious'
-            risk_level = 'high'
-        elif combined_confidence >= 0.5:
-            classification = 'suspicious'
-            risk_level = 'medium'
-        else:
-            classification = 'safe'
-            risk_level = 'low'
+        classification, risk_level = self.risk_band(combined_confidence)
         
         # Combine explanations
         explanations = []
-        if ai_result['explanation']:
-            explanations.append(ai_result['explanation'])
-        if pattern_result['explanation']:
-            explanations.append(pattern_result['explanation'])
+        if ai_result.explanation:
+            explanations.append(ai_result.explanation)
+        if pattern_result.explanation:
+            explanations.append(pattern_result.explanation)
         
         combined_explanation = '; '.join(explanations)
         
-        return {
-            'classification': classification,
-            'confidence': combined_confidence,
-            'explanation': combined_explanation,
-            'risk_level': risk_level,
-            'patterns': pattern_result.get('patterns', [])
-        }
+        return CombinedResult(classification, combined_confidence, combined_explanation, risk_level,
+                              analysis_path, pattern_result)
+
+
+def check_quantization(inference_backend: str = 'torch') -> int:
+    """Print how often int8 and float models agree on the sample corpus."""
+    from model_quantization import compare_predictions
+    
+    float_guardian = EmailGuardian(inference_backend=inference_backend)
+    int8_guardian = EmailGuardian(inference_backend=inference_backend, quantize='int8')
+    if float_guardian.classifier is None or int8_guardian.classifier is None:
+        print("Error: both float and int8 models must load to compare them")
+        return 1
+    
+    report = compare_predictions(float_guardian.classifier, int8_guardian.classifier)
+    print(json.dumps(report, indent=2))
+    print(f"🎯 int8/float agreement: {report['agreement_rate']:.1%} "
+          f"over {report['samples']} samples "
+          f"(max score delta {report['max_score_delta']:.4f})")
+    return 0
 
 
 def main():
@@ -254,13 +857,87 @@ def main():
     parser = argparse.ArgumentParser(description="Smart Email Guardian CLI")
     parser.add_argument("--email", "-e", help="Email text to analyze")
     parser.add_argument("--file", "-f", help="File containing email text")
+    parser.add_argument("--raw", action="store_true",
+                        help="Parse the input as a raw RFC 822 message (headers, MIME parts)")
     parser.add_argument("--json", "-j", action="store_true", help="Output in JSON format")
     parser.add_argument("--pretty", "-p", action="store_true", help="Pretty print output")
+    parser.add_argument("--long-text", choices=EmailGuardian.LONG_TEXT_MODES, default="truncate",
+                        help="How to handle emails longer than the model input")
+    parser.add_argument("--window-aggregation", choices=EmailGuardian.WINDOW_AGGREGATIONS, default="max",
+                        help="How to combine window scores in window mode")
+    parser.add_argument("--max-windows", type=int, default=8,
+                        help="Maximum number of token windows scored per email")
+    parser.add_argument("--patterns-only", action="store_true",
+                        help="Skip the AI model and use pattern matching only")
+    parser.add_argument("--backend", choices=EmailGuardian.INFERENCE_BACKENDS, default="torch",
+                        help="Inference runtime for the AI model")
+    parser.add_argument("--quantize", choices=EmailGuardian.QUANTIZE_MODES,
+                        default=os.environ.get("EMAIL_GUARD_QUANTIZE", "none"),
+                        help="Model quantization (default: $EMAIL_GUARD_QUANTIZE or none)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Skip the AI model when pattern evidence alone decides the result")
+    parser.add_argument("--cascade-min-matches", type=int, default=EmailGuardian.CASCADE_MIN_MATCHES,
+                        help="Rule hits that let --cascade skip the model (0: only when no AI score "
+                             "could change the risk level)")
+    parser.add_argument("--check-quantization", action="store_true",
+                        help="Compare int8 and float predictions on a sample corpus and exit")
+    parser.add_argument("--deny-domains", metavar="FILE",
+                        help="Domain deny-list file (one domain per line)")
+    parser.add_argument("--allow-domains", metavar="FILE",
+                        help="Domain allow-list file; listed hosts are never flagged")
+    parser.add_argument("--brand-domains", metavar="FILE",
+                        help="Protected brand domains for lookalike detection (default: built-in list)")
+    parser.add_argument("--rule-pack", metavar="FILE", default=os.environ.get("EMAIL_GUARD_RULE_PACK"),
+                        help="JSON/YAML rule pack replacing the built-in rules (default: $EMAIL_GUARD_RULE_PACK)")
+    parser.add_argument("--bulk", metavar="PATH",
+                        help="Stream an mbox file, Maildir directory or JSONL file and write NDJSON results")
+    parser.add_argument("--input-format", choices=("auto", "mbox", "maildir", "jsonl"), default="auto",
+                        help="Format of the --bulk input")
+    parser.add_argument("--output", "-o", help="Write --bulk results to this file instead of stdout")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Messages classified per model call in --bulk mode")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for --bulk, sharing one loaded model (0 = one per core)")
+    parser.add_argument("--pin-workers", action="store_true",
+                        help="Pin each --bulk worker to its own CPUs")
+    parser.add_argument("--intra-op-threads", type=int,
+                        default=int(os.environ.get("EMAIL_GUARD_INTRA_OP_THREADS", 0)),
+                        help="Model intra-op threads (default: $EMAIL_GUARD_INTRA_OP_THREADS or all cores)")
+    parser.add_argument("--inter-op-threads", type=int,
+                        default=int(os.environ.get("EMAIL_GUARD_INTER_OP_THREADS", 0)),
+                        help="Model inter-op threads (default: $EMAIL_GUARD_INTER_OP_THREADS or library default)")
+    parser.add_argument("--cpu-affinity", metavar="CPUS", default=os.environ.get("EMAIL_GUARD_CPU_AFFINITY"),
+                        help="Pin to a CPU list such as 0-3,8 (default: $EMAIL_GUARD_CPU_AFFINITY)")
     
     args = parser.parse_args()
     
+    if args.check_quantization:
+        return check_quantization(args.backend)
+    
     # Initialize email guardian
-    guardian = EmailGuardian()
+    guardian = EmailGuardian(
+        long_text=args.long_text,
+        window_aggregation=args.window_aggregation,
+        max_windows=args.max_windows,
+        model_loading='none' if args.patterns_only else 'eager',
+        inference_backend=args.backend,
+        quantize=args.quantize,
+        cascade=args.cascade,
+        cascade_min_matches=args.cascade_min_matches,
+        deny_domains_file=args.deny_domains,
+        allow_domains_file=args.allow_domains,
+        brand_domains_file=args.brand_domains,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        cpu_affinity=args.cpu_affinity,
+        rule_pack_file=args.rule_pack
+    )
+    
+    # Bulk mode loads the model once and streams every message through it
+    if args.bulk:
+        from bulk_scan import bulk_scan
+        return bulk_scan(guardian, args.bulk, args.input_format, args.output, args.batch_size,
+                         args.workers, args.pin_workers)
     
     # Get email text
     email_text = None
@@ -268,21 +945,20 @@ def main():
         email_text = args.email
     elif args.file:
         try:
-            with open(args.file, 'r', encoding='utf-8') as f:
-                email_text = f.read()
+            # Raw messages may carry 8-bit parts in other charsets
+            if args.raw:
+                with open(args.file, 'rb') as f:
+                    email_text = f.read()
+            else:
+                with open(args.file, 'r', encoding='utf-8') as f:
+                    email_text = f.read()
         except Exception as e:
             print(f"Error reading file: {e}")
             return 1
     else:
         # Interactive mode
         print("Enter email text (Ctrl+D to finish):")
-        try:
-            email_text = ""
-            while True:
-                line = input()
-                email_text += line + "\n"
-        except EOFError:
-            pass
+        email_text = sys.stdin.read()
     
     if not email_text or not email_text.strip():
         print("No email text provided")
@@ -290,7 +966,10 @@ def main():
     
     # Analyze email
     try:
-        result = guardian.classify_email(email_text)
+        if args.raw:
+            result = guardian.classify_raw_email(email_text)
+        else:
+            result = guardian.classify_email(email_text)
         
         if args.json:
             print(json.dumps(result, indent=2))
@@ -301,6 +980,7 @@ def main():
             print(f"🎯 Confidence: {result['confidence']:.2%}")
             print(f"⚠️  Risk Level: {result['risk_level'].upper()}")
             print(f"⏱️  Processing Time: {result['processing_time']:.3f}s")
+            print(f"🧭 Analysis Path: {result['analysis_path']}")
             print(f"📝 Explanation: {result['explanation']}")
             
             if result['suspicious_patterns']:
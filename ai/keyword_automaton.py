@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Keyword Automaton
+Linear-time multi-keyword matcher for literal phishing/spam vocabularies.
+"""
+
+import re
+from typing import Dict, Iterable, Set
+
+# Same definition of a word character as the regex \b/\w used by the rules
+WORD_RE = re.compile(r'\w+')
+SPLIT_RE = re.compile(r'(\W+)')
+
+
+class KeywordAutomaton:
+    """Word-level Aho-Corasick trie with regex-compatible word boundaries.
+    
+    Keywords are split into word tokens and the separators between them.
+    The root is keyed by the first token and deeper levels by
+    (separator, token). Every keyword starts and ends on a word character,
+    so a match can only begin at a token start and a whole-token match is
+    exactly a \\b...\\b match. The failure transition therefore always
+    falls back to the next token, and one tokenizing pass finds every
+    keyword regardless of vocabulary size.
+    """
+    
+    def __init__(self):
+        # node = [children, ids of rules whose keyword ends here]
+        self._root: Dict[str, list] = {}
+        self._max_tokens = 0
+        self.size = 0
+    
+    @staticmethod
+    def is_keyword(keyword: str) -> bool:
+        """Return True if keyword can be matched by the automaton."""
+        return (
+            bool(keyword)
+            and WORD_RE.match(keyword[0]) is not None
+            and WORD_RE.match(keyword[-1]) is not None
+        )
+    
+    def add(self, keyword: str, rule_id: int):
+        """Register keyword as evidence for rule_id."""
+        if not self.is_keyword(keyword):
+            raise ValueError(f"Keyword must start and end with a word character: {keyword!r}")
+        
+        parts = SPLIT_RE.split(keyword.lower())
+        node = self._root.setdefault(parts[0], [{}, set()])
+        for i in range(1, len(parts), 2):
+            node = node[0].setdefault((parts[i], parts[i + 1]), [{}, set()])
+        
+        node[1].add(rule_id)
+        self._max_tokens = max(self._max_tokens, len(parts) // 2 + 1)
+        self.size += 1
+    
+    def update(self, keywords: Iterable[str], rule_id: int):
+        """Register every keyword in keywords for rule_id."""
+        for keyword in keywords:
+            self.add(keyword, rule_id)
+    
+    def match(self, text: str) -> Set[int]:
+        """Return the ids of all rules with at least one keyword in text."""
+        found: Set[int] = set()
+        if not self._root:
+            return found
+        
+        # [word, separator, word, ...]; words sit at the even indices
+        parts = SPLIT_RE.split(text.lower())
+        present = self._root.keys() & set(parts[::2])
+        
+        # Single-word keywords need no positions; only phrase heads do
+        heads = set()
+        for token in present:
+            node = self._root[token]
+            found |= node[1]
+            if node[0]:
+                heads.add(token)
+        if not heads:
+            return found
+        
+        root = self._root
+        depth = 2 * self._max_tokens
+        count = len(parts)
+        for i in range(0, count, 2):
+            if parts[i] not in heads:
+                continue
+            node = root[parts[i]]
+            for j in range(i + 1, min(i + depth, count - 1), 2):
+                node = node[0].get((parts[j], parts[j + 1]))
+                if node is None:
+                    break
+                found |= node[1]
+        
+        return found
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Lookalike Domains
+Detects domains imitating protected brands through homoglyphs, leetspeak
+or a single-character typo, using a precomputed deletion-neighbourhood
+index instead of one regex per misspelling.
+"""
+
+import unicodedata
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+# Brands protected when no brand list file is configured
+DEFAULT_BRAND_DOMAINS = (
+    'amazon.com', 'apple.com', 'paypal.com', 'google.com', 'facebook.com',
+    'microsoft.com', 'netflix.com', 'instagram.com', 'linkedin.com', 'outlook.com',
+    'office.com', 'dropbox.com', 'docusign.com', 'chase.com', 'wellsfargo.com',
+    'bankofamerica.com', 'citibank.com', 'americanexpress.com', 'coinbase.com', 'binance.com',
+    'adobe.com', 'icloud.com', 'yahoo.com', 'twitter.com', 'whatsapp.com',
+    'fedex.com', 'dhl.com', 'ups.com', 'usps.com', 'ebay.com',
+)
+
+# Other domains the default brands operate (country sites, mail and short
+# domains). They are never reported, but they are not protected brands
+# themselves: a brand label is only its own under the domains listed.
+DEFAULT_BRAND_ALIASES = (
+    'amazon.co.uk', 'amazon.de', 'amazon.fr', 'amazon.it', 'amazon.es', 'amazon.nl',
+    'amazon.ca', 'amazon.com.au', 'amazon.co.jp', 'amazon.in', 'amazon.com.br', 'amazon.com.mx',
+    'google.co.uk', 'google.de', 'google.fr', 'google.it', 'google.es', 'google.nl',
+    'google.ca', 'google.com.au', 'google.co.jp', 'google.co.in', 'google.com.br', 'google.com.mx',
+    'paypal.me', 'paypal.co.uk', 'paypal.de', 'apple.co', 'ebay.co.uk', 'ebay.de',
+    'live.com', 'hotmail.com', 'msn.com', 'office365.com', 'microsoftonline.com',
+    'yahoo.co.jp', 'yahoo.co.uk', 'dhl.de', 'ups.de', 'fb.com', 'linkedin.cn',
+)
+
+# Characters that render like a Latin letter, mapped to one skeleton letter.
+# i, l, 1 and | all collapse to 'l' so "paypa1" and "paypai" meet "paypal".
+CONFUSABLES = str.maketrans({
+    '0': 'o', '1': 'l', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g',
+    '@': 'a', '$': 's', '|': 'l', '!': 'l', 'i': 'l',
+    # Cyrillic
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o',
+    'р': 'p', 'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'ѕ': 's', 'і': 'l', 'ї': 'l',
+    'ј': 'j', 'ԁ': 'd', 'ԛ': 'q', 'ԝ': 'w', 'һ': 'h', 'ӏ': 'l', 'ո': 'n', 'ս': 'u',
+    # Greek
+    'α': 'a', 'β': 'b', 'ε': 'e', 'η': 'n', 'ι': 'l', 'κ': 'k', 'ν': 'v', 'ο': 'o',
+    'ρ': 'p', 'τ': 't', 'υ': 'u', 'χ': 'x', 'ω': 'w',
+    # Latin lookalikes without a decomposition
+    'ı': 'l', 'ł': 'l', 'ɡ': 'g', 'ɑ': 'a', 'ø': 'o', 'đ': 'd', 'ħ': 'h',
+})
+
+# Letter pairs that read as one letter at a glance
+MULTI_CHAR_CONFUSABLES = (('rn', 'm'), ('vv', 'w'), ('cl', 'd'))
+
+# Second-level labels that sit under a country code (example.co.uk)
+SECOND_LEVEL_SUFFIXES = frozenset({'co', 'com', 'net', 'org', 'ac', 'gov', 'edu', 'ne', 'or', 'go'})
+
+# Typos are only matched for brand names at least this long; shorter
+# ones sit one edit away from too many ordinary words (apple/apply)
+MIN_FUZZY_LENGTH = 6
+
+# Subdomain and hyphenated parts must be this long to count (not ups/dhl)
+MIN_PART_LENGTH = 4
+
+# Words of an impersonating host around a plainly spelled brand name
+# (paypal-login.com, secure-paypal.com, amazon-security.net)
+IMPERSONATION_WORDS = frozenset({
+    'login', 'logon', 'signin', 'secure', 'security', 'verify', 'verification', 'account',
+    'accounts', 'support', 'update', 'billing', 'auth', 'confirm', 'service', 'services',
+    'help', 'wallet', 'recovery', 'unlock', 'alert', 'id', 'password', 'payment',
+})
+
+
+def skeleton(label: str) -> str:
+    """Reduce a domain label to its visual skeleton.
+    
+    Compatibility forms (fullwidth, ligatures) are folded, accents are
+    stripped, and homoglyphs, digits and letter pairs that look alike are
+    mapped to a single representative.
+    """
+    label = unicodedata.normalize('NFKD', label.lower())
+    label = ''.join(char for char in label if not unicodedata.combining(char))
+    label = label.translate(CONFUSABLES)
+    for pair, letter in MULTI_CHAR_CONFUSABLES:
+        label = label.replace(pair, letter)
+    return label
+
+
+def registrable_label(host: str) -> str:
+    """Label a domain is registered under (paypal in login.paypal.co.uk)."""
+    labels = host.split('.')
+    if len(labels) >= 3 and labels[-2] in SECOND_LEVEL_SUFFIXES and len(labels[-1]) == 2:
+        return labels[-3]
+    return labels[-2] if len(labels) >= 2 else labels[0]
+
+
+def deletions(word: str) -> Iterator[str]:
+    """Every string obtained by deleting one character from word."""
+    for i in range(len(word)):
+        yield word[:i] + word[i + 1:]
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """True if a and b are at most one edit (or adjacent swap) apart."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diffs) == 1 or (
+            len(diffs) == 2 and diffs[1] == diffs[0] + 1
+            and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+        )
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    return any(shorter == candidate for candidate in deletions(longer))
+
+
+class LookalikeIndex:
+    """Deletion-neighbourhood index of protected brand skeletons.
+    
+    Each brand skeleton is stored with all of its one-character
+    deletions. A candidate label matches a brand within one edit exactly
+    when their deletion neighbourhoods intersect, so a lookup costs
+    len(label) + 1 dictionary probes whatever the number of brands.
+    """
+    
+    def __init__(self, brand_domains: Iterable[str] = DEFAULT_BRAND_DOMAINS,
+                 own_domains: Iterable[str] = DEFAULT_BRAND_ALIASES):
+        """Index the brand domains (e.g. 'paypal.com').
+        
+        own_domains are further legitimate domains of the brands; they and
+        their subdomains are never reported.
+        """
+        self.brand_domains: Set[str] = set()
+        self.brand_labels: Set[str] = set()
+        self.own_domains: Set[str] = {domain.lower().rstrip('.') for domain in own_domains}
+        self._exact: Dict[str, str] = {}
+        self._neighbours: Dict[str, Set[str]] = {}
+        for domain in brand_domains:
+            self.add(domain)
+    
+    def add(self, domain: str):
+        """Protect domain and any host that imitates its brand label."""
+        domain = domain.lower().rstrip('.')
+        self.brand_domains.add(domain)
+        label = registrable_label(domain)
+        self.brand_labels.add(label)
+        brand = skeleton(label)
+        self._exact.setdefault(brand, domain)
+        if len(brand) >= MIN_FUZZY_LENGTH:
+            for variant in (brand, *deletions(brand)):
+                self._neighbours.setdefault(variant, set()).add(brand)
+    
+    def is_brand_host(self, host: str) -> bool:
+        """True for a brand's own domain or one of its subdomains."""
+        labels = host.split('.')
+        return any(
+            '.'.join(labels[i:]) in self.brand_domains or '.'.join(labels[i:]) in self.own_domains
+            for i in range(len(labels) - 1)
+        )
+    
+    def match_label(self, label: str) -> Optional[str]:
+        """Brand domain whose label this one spells or imitates, if any.
+        
+        Typos must keep the brand's first and last letters: most one-edit
+        neighbours of a brand that change either are ordinary words
+        (finance/binance, officer/office).
+        """
+        label = skeleton(label)
+        if label in self._exact:
+            return self._exact[label]
+        if len(label) < MIN_FUZZY_LENGTH - 1:
+            return None
+        for variant in (label, *deletions(label)):
+            for brand in self._neighbours.get(variant, ()):
+                if label[0] == brand[0] and label[-1] == brand[-1] and within_one_edit(label, brand):
+                    return self._exact[brand]
+        return None
+    
+    def match(self, host: str) -> Optional[str]:
+        """Brand domain imitated by host, or None.
+        
+        Hosts outside the brands' own domains are reported when their
+        registrable label spells a brand (paypal.tk) or imitates one
+        through homoglyphs, leetspeak or a typo, and when another label
+        or hyphenated part does (paypa1.secure-login.tk). A brand spelled
+        plainly outside the registrable label is often just a word
+        (office.mycompany.com, big-apple-bakery.com), so it is reported
+        next to login/security wording or the brand's own domain name
+        (paypal-login.com, accounts.google.com.evil.ru).
+        """
+        host = host.lower().rstrip('.')
+        if not host or self.is_brand_host(host):
+            return None
+        if 'xn--' in host:
+            # Homoglyphs only show in the Unicode form of punycode labels
+            try:
+                host = host.encode('ascii').decode('idna')
+            except UnicodeError:
+                pass
+        
+        registrable = registrable_label(host)
+        brand = self.match_label(registrable)
+        if brand:
+            return brand
+        
+        labels = host.split('.')[:-1]
+        lure = any(part in IMPERSONATION_WORDS for label in labels for part in label.split('-'))
+        for label in labels:
+            for part in (label, *label.split('-')):
+                if len(part) < MIN_PART_LENGTH:
+                    continue
+                brand = self.match_label(part)
+                if not brand:
+                    continue
+                if part in self.brand_labels and not (lure or f".{brand}." in f".{host}."):
+                    continue
+                return brand
+        return None
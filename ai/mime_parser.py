@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - MIME Parser
+Splits a raw RFC 822 message into the parts the classifier scores:
+headers, one preferred text body, URLs and attachment filenames.
+Attachment payloads are never decoded.
+"""
+
+import re
+from email import policy
+from email.parser import BytesParser, Parser
+from typing import Dict, List, Union
+
+URL_RE = re.compile(r'https?://[^\s<>"\'()]+', re.IGNORECASE)
+HREF_RE = re.compile(r'\b(?:href|src)\s*=\s*["\']?([^"\'\s>]+)', re.IGNORECASE)
+
+# Headers whose addresses are checked by the sender rules
+SENDER_HEADERS = ('from', 'reply-to', 'return-path', 'sender')
+
+
+def parse_raw_email(raw: Union[str, bytes]) -> Dict:
+    """Parse a raw message into subject, senders, body, URLs and attachments.
+    
+    The body is the preferred text/plain part (text/html otherwise);
+    other text alternatives are only read for links. Non-text parts and
+    anything marked as an attachment contribute their filename only.
+    """
+    if isinstance(raw, bytes):
+        message = BytesParser(policy=policy.default).parsebytes(raw)
+    else:
+        message = Parser(policy=policy.default).parsestr(raw)
+    
+    subject = str(message.get('subject', '') or '')
+    senders = []
+    for name in SENDER_HEADERS:
+        for value in message.get_all(name, []):
+            addresses = getattr(value, 'addresses', None)
+            if addresses:
+                senders.extend((name, address.addr_spec) for address in addresses)
+            else:
+                senders.append((name, str(value).strip('<> ')))
+    
+    body_part = message.get_body(preferencelist=('plain', 'html'))
+    body = part_text(body_part) if body_part is not None else ''
+    body_type = body_part.get_content_subtype() if body_part is not None else None
+    
+    urls: List[str] = []
+    attachments: List[str] = []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        if part.is_attachment() or part.get_content_maintype() != 'text':
+            filename = part.get_filename()
+            if filename:
+                attachments.append(filename)
+            continue
+        if part is body_part:
+            urls.extend(URL_RE.findall(body))
+        if part.get_content_subtype() == 'html':
+            # Link targets hidden behind anchor text only exist in the HTML
+            urls.extend(HREF_RE.findall(body if part is body_part else part_text(part)))
+    
+    return {
+        'subject': subject,
+        'senders': senders,
+        'body': body,
+        'body_type': body_type,
+        'text': f"{subject}\n{body}" if subject else body,
+        'urls': list(dict.fromkeys(url for url in urls if url.lower().startswith(('http://', 'https://')))),
+        'attachments': attachments
+    }
+
+
+def part_text(part) -> str:
+    """Decoded text of a text/* part, tolerating unknown charsets."""
+    try:
+        return part.get_content()
+    except (LookupError, ValueError):
+        payload = part.get_payload(decode=True) or b''
+        return payload.decode('utf-8', 'replace')
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Model Quantization
+Dynamic int8 quantization of the classifier, cached on disk, with an
+agreement check against the float model.
+"""
+
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_QUANTIZED_DIR = Path(
+    os.environ.get("EMAIL_GUARD_QUANTIZED_DIR", Path(__file__).parent / "models" / "quantized")
+)
+
+# Small mixed corpus for comparing float and quantized predictions
+SAMPLE_CORPUS = [
+    "Hi Sarah, could we move our quarterly review to Thursday afternoon?",
+    "Attached is the updated project plan. Let me know if anything is missing.",
+    "Thanks for the quick turnaround on the invoice, everything looks good.",
+    "Reminder: the team lunch is tomorrow at noon in the main cafeteria.",
+    "URGENT: Your account has been suspended. Verify now to avoid closure.",
+    "Dear customer, your password expired. Log in at http://secure-login.tk to restore access.",
+    "Your bank account is locked due to a billing issue. Confirm your credit card details.",
+    "Final notice: payment overdue. Click here immediately or your service ends today.",
+    "CONGRATULATIONS!!! You are a WINNER of our million dollars lottery prize!",
+    "Buy now and save money! Limited time discount on diet pills, order now!!!",
+    "Make money fast from home, free trial, no obligation, subscribe today.",
+    "You are an idiot and nobody wants you here, get lost.",
+]
+
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """Yield a unique temporary file beside path, moved onto path on success.
+    
+    Concurrent writers each get their own file, and a crashed write never
+    leaves a partial file under the cached name.
+    """
+    fd, name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".partial")
+    os.close(fd)
+    temp_path = Path(name)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def quantized_model_path(model_name: str, cache_dir: Optional[Path] = None) -> Path:
+    """Cache file for a quantized model, keyed by library versions."""
+    import torch
+    import transformers
+    
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '--', model_name)
+    versions = f"torch{torch.__version__}-transformers{transformers.__version__}"
+    versions = re.sub(r'[^A-Za-z0-9_.-]+', '_', versions)
+    return Path(cache_dir or DEFAULT_QUANTIZED_DIR) / safe_name / f"model.int8.{versions}.safetensors"
+
+
+def quantize_model(model):
+    """Apply dynamic int8 quantization to the model's linear layers."""
+    import torch
+    
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_linears(model) -> Iterator[Tuple[str, object]]:
+    """(name, module) of every dynamically quantized linear layer."""
+    import torch
+    
+    for name, module in model.named_modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            yield name, module
+
+
+def save_quantized_model(model, path: Path):
+    """Write a quantized model's weights as plain tensors (safetensors).
+    
+    Quantized weights are stored as their int8 values plus scales, so
+    loading never unpickles anything from the cache directory.
+    """
+    import torch
+    from safetensors.torch import save_file
+    
+    per_channel = (torch.per_channel_affine, torch.per_channel_symmetric)
+    tensors = {}
+    prefixes = []
+    for name, module in quantized_linears(model):
+        prefixes.append(f"{name}.")
+        weight, bias = module._weight_bias()
+        tensors[f"{name}.weight_int8"] = weight.int_repr()
+        if weight.qscheme() in per_channel:
+            tensors[f"{name}.weight_scales"] = weight.q_per_channel_scales()
+            tensors[f"{name}.weight_zero_points"] = weight.q_per_channel_zero_points()
+            tensors[f"{name}.weight_axis"] = torch.tensor([weight.q_per_channel_axis()])
+        else:
+            tensors[f"{name}.weight_scales"] = torch.tensor([weight.q_scale()], dtype=torch.float64)
+            tensors[f"{name}.weight_zero_points"] = torch.tensor([weight.q_zero_point()])
+        if bias is not None:
+            tensors[f"{name}.bias"] = bias
+    
+    for key, value in model.state_dict().items():
+        if key.startswith(tuple(prefixes)) or not isinstance(value, torch.Tensor):
+            continue
+        # Clones, as safetensors refuses tied (shared) tensors
+        tensors[key] = value.detach().contiguous().clone()
+    
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with atomic_path(path) as partial_path:
+        save_file(tensors, str(partial_path))
+
+
+def load_quantized_model(model, path: Path):
+    """Load save_quantized_model weights into a freshly quantized model."""
+    import torch
+    from safetensors.torch import load_file
+    
+    tensors = load_file(str(path))
+    prefixes = []
+    for name, module in quantized_linears(model):
+        prefixes.append(f"{name}.")
+        values = tensors.pop(f"{name}.weight_int8")
+        scales = tensors.pop(f"{name}.weight_scales")
+        zero_points = tensors.pop(f"{name}.weight_zero_points")
+        axis = tensors.pop(f"{name}.weight_axis", None)
+        if axis is not None:
+            weight = torch._make_per_channel_quantized_tensor(values, scales, zero_points, int(axis[0]))
+        else:
+            weight = torch._make_per_tensor_quantized_tensor(values, float(scales[0]), int(zero_points[0]))
+        module.set_weight_bias(weight, tensors.pop(f"{name}.bias", None))
+    
+    # Copied in place: load_state_dict would insist on the quantized
+    # layers' packed parameters
+    targets = {
+        key: value for key, value in model.state_dict(keep_vars=True).items()
+        if isinstance(value, torch.Tensor) and not key.startswith(tuple(prefixes))
+    }
+    mismatched = sorted(set(targets) ^ set(tensors))
+    if mismatched:
+        raise ValueError(f"Quantized cache does not match the model: {mismatched[:3]}")
+    with torch.no_grad():
+        for key, value in tensors.items():
+            targets[key].copy_(value)
+    return model
+
+
+def load_quantized_pipeline(model_name: str, cache_dir: Optional[Path] = None):
+    """Build a text-classification pipeline around a cached int8 model.
+    
+    The cached weights are loaded into a model built from the config, so
+    later startups neither read the float weights nor convert again.
+    The cache file name includes the torch and transformers versions.
+    """
+    from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer, pipeline
+    
+    path = quantized_model_path(model_name, cache_dir)
+    model = None
+    if path.exists():
+        try:
+            config = AutoConfig.from_pretrained(model_name)
+            model = load_quantized_model(
+                quantize_model(AutoModelForSequenceClassification.from_config(config)), path
+            )
+        except Exception as e:
+            print(f"⚠️  Ignoring quantized cache {path}: {e}")
+    if model is None:
+        print(f"🧮 Quantizing {model_name} to int8: {path}")
+        model = quantize_model(AutoModelForSequenceClassification.from_pretrained(model_name))
+        save_quantized_model(model, path)
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return pipeline("text-classification", model=model, tokenizer=tokenizer, device=-1)
+
+
+def quantize_onnx_model(model_path: Path, quantized_path: Path):
+    """Dynamic int8 quantization of an exported ONNX graph."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    
+    with atomic_path(quantized_path) as partial_path:
+        quantize_dynamic(str(model_path), str(partial_path), weight_type=QuantType.QInt8)
+
+
+def compare_predictions(float_classifier: Callable, quantized_classifier: Callable,
+                        texts: Optional[List[str]] = None) -> Dict:
+    """Compare top labels and scores of float and quantized classifiers."""
+    texts = list(texts or SAMPLE_CORPUS)
+    float_outputs = float_classifier(texts, batch_size=len(texts))
+    quantized_outputs = quantized_classifier(texts, batch_size=len(texts))
+    
+    agreements = 0
+    deltas = []
+    disagreements = []
+    for text, expected, actual in zip(texts, float_outputs, quantized_outputs):
+        if expected['label'] == actual['label']:
+            agreements += 1
+            deltas.append(abs(expected['score'] - actual['score']))
+        else:
+            # Compare the probability of the same label on both sides
+            deltas.append(abs(expected['score'] - (1.0 - actual['score'])))
+            disagreements.append({
+                'text': text,
+                'float': expected,
+                'int8': actual
+            })
+    
+    return {
+        'samples': len(texts),
+        'agreement_rate': agreements / len(texts) if texts else 1.0,
+        'mean_score_delta': sum(deltas) / len(deltas) if deltas else 0.0,
+        'max_score_delta': max(deltas) if deltas else 0.0,
+        'disagreements': disagreements
+    }
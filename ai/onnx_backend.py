@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - ONNX Runtime Backend
+Exports the HuggingFace classifier to ONNX once and runs it on CPU.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from model_quantization import atomic_path, quantize_onnx_model
+
+# Exported models live next to the HuggingFace cache used by the Dockerfile
+DEFAULT_ONNX_DIR = Path(
+    os.environ.get("EMAIL_GUARD_ONNX_DIR", Path(__file__).parent / "models" / "onnx")
+)
+MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model.int8.onnx"
+
+
+def model_cache_dir(model_name: str, cache_dir: Optional[Path] = None) -> Path:
+    """Directory holding the exported graph, tokenizer and config of a model."""
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '--', model_name)
+    return Path(cache_dir or DEFAULT_ONNX_DIR) / safe_name
+
+
+def export_onnx_model(model_name: str, output_dir: Path, opset: int = 14) -> Path:
+    """Export a sequence-classification model to ONNX (needs torch, runs once)."""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+    
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in tokenizer.model_input_names if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    
+    # The graph lands under its final name last, once the tokenizer and
+    # config it needs are in place
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+    model_path = output_dir / MODEL_FILE
+    with atomic_path(model_path) as partial_path, torch.no_grad():
+        torch.onnx.export(
+            model,
+            ({name: sample[name] for name in input_names},),
+            str(partial_path),
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True
+        )
+    return model_path
+
+
+def optimize_onnx_model(model_path: Path, optimized_path: Path):
+    """Apply operator fusion once and cache the fused graph on disk.
+    
+    Only the portable EXTENDED level is serialized; layout optimizations
+    specific to the current CPU are re-applied at session start.
+    """
+    import onnxruntime
+    
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    with atomic_path(optimized_path) as partial_path:
+        options.optimized_model_filepath = str(partial_path)
+        onnxruntime.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+
+
+class OnnxTextClassifier:
+    """Pipeline-compatible text classifier backed by ONNX Runtime."""
+    
+    def __init__(self, model_name: str, cache_dir: Optional[Path] = None,
+                 intra_op_threads: int = 0, inter_op_threads: int = 0,
+                 quantize: str = 'none'):
+        """Load (exporting first if needed) the ONNX graph for model_name.
+        
+        quantize='int8' runs a dynamically quantized copy of the graph,
+        produced once from the float export and cached beside it.
+        """
+        import onnxruntime
+        from transformers import AutoConfig, AutoTokenizer
+        
+        self.model_name = model_name
+        self.model_dir = model_cache_dir(model_name, cache_dir)
+        
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        
+        # A truncated or stale cached graph is rebuilt rather than given up
+        # on: first the graphs derived from the export, then the export
+        export_path = self.model_dir / MODEL_FILE
+        int8_path = self.model_dir / INT8_MODEL_FILE
+        derived = [int8_path, export_path.with_suffix(".optimized.onnx"), int8_path.with_suffix(".optimized.onnx")]
+        stale_stages = [[path for path in stage if path.exists()] for stage in (derived, [export_path])]
+        stale_stages = [stage for stage in stale_stages if stage]
+        while True:
+            try:
+                self.session = self.load_session(quantize, options)
+                break
+            except Exception as e:
+                if not stale_stages:
+                    raise
+                stale = stale_stages.pop(0)
+                names = ', '.join(path.name for path in stale)
+                print(f"⚠️  Cached ONNX model failed to load ({e}); rebuilding {names}")
+                for path in stale:
+                    path.unlink(missing_ok=True)
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        
+        # Tokenizer and config come from the export directory, so serving
+        # needs neither torch nor network access
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        self.config = AutoConfig.from_pretrained(self.model_dir)
+        self.max_length = min(self.tokenizer.model_max_length, 512)
+    
+    def load_session(self, quantize: str, options):
+        """Create the inference session, building any missing cached graph."""
+        import onnxruntime
+        
+        model_path = self.model_dir / MODEL_FILE
+        if not model_path.exists():
+            print(f"📦 Exporting {self.model_name} to ONNX: {model_path}")
+            export_onnx_model(self.model_name, self.model_dir)
+        
+        if quantize == 'int8':
+            float_path = model_path
+            model_path = self.model_dir / INT8_MODEL_FILE
+            if not model_path.exists():
+                print(f"🧮 Quantizing ONNX graph to int8: {model_path}")
+                quantize_onnx_model(float_path, model_path)
+        
+        optimized_path = model_path.with_suffix(".optimized.onnx")
+        if not optimized_path.exists():
+            optimize_onnx_model(model_path, optimized_path)
+        
+        return onnxruntime.InferenceSession(str(optimized_path), options, providers=["CPUExecutionProvider"])
+    
+    def logits(self, encoded: Dict):
+        """Run the graph on already-tokenized numpy inputs."""
+        feed = {name: encoded[name].astype("int64") for name in self.input_names}
+        return self.session.run(["logits"], feed)[0]
+    
+    def __call__(self, inputs: Union[str, List[str]], batch_size: Optional[int] = None) -> List[Dict]:
+        """Classify one or more texts, returning pipeline-style top labels."""
+        import numpy as np
+        
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        batch_size = batch_size or len(texts) or 1
+        results = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size],
+                truncation=True,
+                max_length=self.max_length,
+                padding=True,
+                return_tensors="np"
+            )
+            probabilities = softmax(self.logits(encoded))
+            for row in probabilities:
+                index = int(np.argmax(row))
+                results.append({
+                    'label': self.config.id2label[index],
+                    'score': float(row[index])
+                })
+        return results
+
+
+def softmax(logits):
+    """Row-wise softmax over a numpy logits matrix."""
+    import numpy as np
+    
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
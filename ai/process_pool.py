@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Process Pool
+Spreads batch classification across CPU cores. Workers are forked from a
+parent that has already loaded the model, so they share its weights
+copy-on-write instead of loading one copy each.
+"""
+
+import gc
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Union
+
+from cpu_tuning import available_cpus, configure_torch_threads, cpu_ids, set_cpu_affinity, worker_cpus
+
+# Set in the parent just before the workers fork; each worker inherits it
+_worker_guardian = None
+
+
+def _init_worker(torch_threads: int, cpu_sets: List[List[int]], counter):
+    """Give each worker its share of the cores for torch intra-op threads."""
+    # Timings travel back with the results and reach the parent's hooks;
+    # hooks inherited through the fork would record into a dead copy
+    _worker_guardian.timing_hooks = []
+    _worker_guardian.stage_timings = True
+    
+    if cpu_sets:
+        with counter.get_lock():
+            index = counter.value
+            counter.value += 1
+        set_cpu_affinity(cpu_sets[index % len(cpu_sets)])
+    
+    # Only if the parent loaded torch; importing it here would cost each
+    # worker a second of startup and unshared memory for nothing
+    torch = sys.modules.get('torch')
+    if torch is None:
+        return
+    # Inter-op threads are already fixed if the parent ran inference
+    # before forking; the intra-op split still applies
+    configure_torch_threads(torch, torch_threads, 1)
+
+
+def _classify_chunk(method: str, messages: List, batch_size: int) -> List[Dict]:
+    """Worker task: classify one chunk with the inherited guardian."""
+    return getattr(_worker_guardian, method)(messages, batch_size=batch_size)
+
+
+class GuardianProcessPool:
+    """Fork-based worker pool exposing EmailGuardian.classify_batch and
+    classify_raw_batch.
+    
+    The guardian must be fully loaded before the pool is created. Results
+    come back in input order. Torch threads are split so that workers
+    times threads per worker does not exceed the available cores; an
+    ONNX Runtime session keeps the thread count it was created with.
+    pin_cpus=True also pins each worker to its own disjoint set of CPUs.
+    Requires the 'fork' start method (Linux/macOS).
+    """
+    
+    def __init__(self, guardian, workers: Optional[int] = None, pin_cpus: bool = False):
+        global _worker_guardian
+        
+        cpus = available_cpus()
+        self.workers = workers or cpus
+        if self.workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.torch_threads = max(1, cpus // self.workers)
+        self.cpu_sets = (
+            [worker_cpus(i, self.workers, cpu_ids()) for i in range(self.workers)]
+            if pin_cpus else []
+        )
+        self.guardian = guardian
+        
+        # Move everything allocated so far (model included) out of the
+        # collector's reach, so workers' GC passes do not write to and
+        # un-share those pages
+        _worker_guardian = guardian
+        gc.collect()
+        gc.freeze()
+        
+        context = multiprocessing.get_context('fork')
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.torch_threads, self.cpu_sets, context.Value('i', 0))
+        )
+    
+    def classify_batch(self, texts: List[str], batch_size: int = 32) -> List[Dict]:
+        """Classify texts in chunks of batch_size spread over the workers."""
+        return self.map_chunks('classify_batch', texts, batch_size)
+    
+    def classify_raw_batch(self, raw_messages: List[Union[str, bytes]], batch_size: int = 32) -> List[Dict]:
+        """Parse and classify raw messages in chunks spread over the workers."""
+        return self.map_chunks('classify_raw_batch', raw_messages, batch_size)
+    
+    def map_chunks(self, method: str, messages: List, batch_size: int) -> List[Dict]:
+        """Run a guardian batch method over chunks of messages in the workers."""
+        futures = [
+            self.executor.submit(_classify_chunk, method, messages[start:start + batch_size], batch_size)
+            for start in range(0, len(messages), batch_size)
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        
+        guardian = self.guardian
+        for result in results:
+            stage_timings = result['stage_timings'] if guardian.stage_timings else result.pop('stage_timings')
+            guardian.notify_timings(stage_timings, result)
+        return results
+    
+    def close(self):
+        """Shut the workers down and return frozen objects to the collector."""
+        self.executor.shutdown()
+        gc.unfreeze()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Result Types
+Compact slotted results passed between the classification stages. Matched
+rules are carried as short rule ids; human-readable descriptions are only
+looked up when a result is turned into the public dict.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Ids reported for domain findings, which are not rules of the rule pack
+DENY_LIST_ID = 'deny_list'
+LOOKALIKE_ID = 'lookalike_domain'
+RESERVED_RULE_IDS = frozenset({DENY_LIST_ID, LOOKALIKE_ID})
+
+
+class SlottedResult:
+    """Read access by key (result['confidence']), as for the old dicts."""
+    
+    __slots__ = ()
+    
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def __contains__(self, key: str) -> bool:
+        return hasattr(self, key)
+    
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+    
+    def __repr__(self) -> str:
+        names = [name for cls in reversed(type(self).__mro__) for name in getattr(cls, '__slots__', ())]
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in names)
+        return f"{type(self).__name__}({fields})"
+
+
+class AIResult(SlottedResult):
+    """Model verdict for one message."""
+    
+    __slots__ = ('classification', 'confidence', 'explanation', 'skipped')
+    
+    def __init__(self, classification: str, confidence: float, explanation: str, skipped: bool = False):
+        self.classification = classification
+        self.confidence = confidence
+        self.explanation = explanation
+        self.skipped = skipped
+
+
+class RuleMatches(SlottedResult):
+    """Matched rule ids plus the descriptions of domain findings.
+    
+    rules is the rule snapshot that produced the ids; it resolves their
+    descriptions and reports the rule-pack version.
+    """
+    
+    __slots__ = ('rule_ids', 'findings', 'url_results', 'rules')
+    
+    @property
+    def patterns(self) -> List[str]:
+        """Human-readable description of every match, rules first."""
+        descriptions = self.rules.descriptions if self.rules is not None else {}
+        return [descriptions[rule_id] for rule_id in self.rule_ids if rule_id in descriptions] + list(self.findings)
+    
+    @property
+    def rule_pack_version(self) -> Optional[str]:
+        return self.rules.version if self.rules is not None else None
+
+
+class PatternResult(RuleMatches):
+    """Pattern-matching verdict for one message."""
+    
+    __slots__ = ('classification', 'confidence', 'explanation')
+    
+    def __init__(self, classification: str, confidence: float, explanation: str,
+                 rule_ids: Tuple[str, ...] = (), findings: Sequence[str] = (),
+                 url_results: Optional[List[Dict]] = None, rules=None):
+        self.classification = classification
+        self.confidence = confidence
+        self.explanation = explanation
+        self.rule_ids = rule_ids
+        self.findings = tuple(findings)
+        self.url_results = url_results if url_results is not None else []
+        self.rules = rules
+
+
+class CombinedResult(RuleMatches):
+    """Final verdict, as kept in the result cache."""
+    
+    __slots__ = ('classification', 'confidence', 'explanation', 'risk_level', 'analysis_path')
+    
+    def __init__(self, classification: str, confidence: float, explanation: str, risk_level: str,
+                 analysis_path: str, pattern_result: PatternResult):
+        self.classification = classification
+        self.confidence = confidence
+        self.explanation = explanation
+        self.risk_level = risk_level
+        self.analysis_path = analysis_path
+        self.rule_ids = pattern_result.rule_ids
+        self.findings = pattern_result.findings
+        self.url_results = pattern_result.url_results
+        self.rules = pattern_result.rules
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Rule Engine
+Compiled single-pass matcher for the phishing/spam pattern rules.
+"""
+
+import re
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+
+from keyword_automaton import KeywordAutomaton
+
+# Rules of the form \b(word|word phrase|...)\b are plain vocabularies
+LITERAL_RULE_RE = re.compile(r'\\b\(([\w ]+(?:\|[\w ]+)*)\)\\b')
+
+
+def literal_keywords(pattern: str) -> Optional[List[str]]:
+    """Return the keyword list of a literal vocabulary rule, else None."""
+    match = LITERAL_RULE_RE.fullmatch(pattern)
+    if not match:
+        return None
+    keywords = match.group(1).split('|')
+    if not all(KeywordAutomaton.is_keyword(keyword) for keyword in keywords):
+        return None
+    return keywords
+
+
+class RuleEngine:
+    """Immutable, precompiled set of pattern rules scanned in one pass.
+    
+    Literal vocabulary rules go into a keyword automaton whose cost does
+    not grow with the number of keywords; only structural rules (URLs,
+    IPs, punctuation runs, capitalisation) are compiled into the regex.
+    """
+    
+    # Upper bound on cached alternations, one per rule subset passed as only
+    MAX_CACHED_REGEXES = 256
+    
+    def __init__(self, rules: Sequence[Tuple[str, str]], flags: int = re.IGNORECASE):
+        """Split (label, pattern) rules into keyword and regex matchers."""
+        self.rules = tuple(rules)
+        self.flags = flags
+        self.descriptions = tuple(
+            f"{label} pattern: {pattern}" for label, pattern in self.rules
+        )
+        
+        # Content fingerprint of the rule set, used to key cached results
+        digest = hashlib.sha256()
+        for label, pattern in self.rules:
+            digest.update(f"{label}\0{pattern}\0".encode('utf-8'))
+        self.version = digest.hexdigest()[:12]
+        self.keywords = KeywordAutomaton()
+        structural = []
+        keyword_rules = set()
+        for index, (_, pattern) in enumerate(self.rules):
+            keywords = literal_keywords(pattern)
+            if keywords is None:
+                structural.append(index)
+            else:
+                self.keywords.update(keywords, index)
+                keyword_rules.add(index)
+        
+        self._all = tuple(structural)
+        self._keyword_rules = frozenset(keyword_rules)
+        # Each structural rule on its own, for the checks after a first hit
+        self._patterns = {index: re.compile(self.rules[index][1], flags) for index in structural}
+        self._regexes = {}
+        if self._all:
+            self._compile(self._all)
+    
+    def _compile(self, indices: Tuple[int, ...]):
+        """Build one regex with a named group per rule, in rule order."""
+        regex = self._regexes.get(indices)
+        if regex is None:
+            if len(self._regexes) >= self.MAX_CACHED_REGEXES:
+                self._regexes.clear()
+            regex = re.compile(
+                '|'.join(f'(?P<r{i}>{self.rules[i][1]})' for i in indices),
+                self.flags
+            )
+            self._regexes[indices] = regex
+        return regex
+    
+    def prepare(self, only: Sequence[int]):
+        """Compile the regex alternation match() uses for this rule subset."""
+        remaining = tuple(i for i in self._all if i in frozenset(only))
+        if remaining:
+            self._compile(remaining)
+    
+    def match(self, text: str, only: Optional[Sequence[int]] = None) -> List[int]:
+        """Return the indices of all rules that match anywhere in text.
+        
+        Keyword rules are resolved by the automaton. The regex rules share
+        one alternation, so clean mail costs exactly one scan. It reports
+        only the first rule at the leftmost hit; the other rules are then
+        checked with their own precompiled patterns from the start of that
+        hit, since none of them can match any earlier.
+        
+        only restricts the scan to a subset of rule indices.
+        """
+        if only is None:
+            matched = self.keywords.match(text)
+            remaining = self._all
+        else:
+            only = frozenset(only)
+            matched = set()
+            if not only.isdisjoint(self._keyword_rules):
+                matched = self.keywords.match(text) & only
+            remaining = tuple(i for i in self._all if i in only)
+        if not remaining:
+            return sorted(matched)
+        
+        hit = self._compile(remaining).search(text)
+        if hit is None:
+            return sorted(matched)
+        first = int(hit.lastgroup[1:])
+        matched.add(first)
+        pos = hit.start()
+        for index in remaining:
+            if index != first and self._patterns[index].search(text, pos):
+                matched.add(index)
+        
+        return sorted(matched)
+    
+    def scan(self, text: str) -> List[str]:
+        """Return human-readable descriptions of every matching rule."""
+        return [self.descriptions[i] for i in self.match(text)]
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Rule Packs
+Loads phishing/spam rules from a local JSON or YAML rule pack, compiles
+them into an immutable snapshot and watches the file so updated packs
+can be swapped in without a redeploy.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from results import RESERVED_RULE_IDS
+from rule_engine import RuleEngine
+
+# Rule categories in the order their matches are reported
+CATEGORIES = ('phishing', 'spam')
+
+# Message parts a rule can be scoped to (see EmailGuardian.classify_raw_email)
+SCOPES = ('text', 'attachments')
+
+# Rules answered by the URL index instead of their regex
+URL_CHECKS = ('suspicious_tld', 'ip_literal', 'sender_tld')
+
+# Built-in rules, used when no rule pack file is configured
+DEFAULT_RULE_PACK = {
+    'version': 'builtin-1',
+    'rules': [
+        # Urgency patterns
+        {'id': 'urgency', 'category': 'phishing',
+         'pattern': r'\b(urgent|immediate|action required|account suspended|verify now)\b'},
+        {'id': 'deadline', 'category': 'phishing',
+         'pattern': r'\b(limited time|expires soon|last chance|final notice)\b'},
+        
+        # Financial threats
+        {'id': 'account_threat', 'category': 'phishing',
+         'pattern': r'\b(account locked|payment overdue|billing issue|refund pending)\b'},
+        {'id': 'financial_terms', 'category': 'phishing',
+         'pattern': r'\b(credit card|bank account|social security|password expired)\b'},
+        
+        # Suspicious URLs
+        {'id': 'url_suspicious_tld', 'category': 'phishing', 'check': 'suspicious_tld',
+         'pattern': r'https?://[^\s]*\.(tk|ml|ga|cf|gq|xyz|top|club|online|site)\b'},
+        {'id': 'url_ip_literal', 'category': 'phishing', 'check': 'ip_literal',
+         'pattern': r'https?://[^\s]*\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b'},
+        
+        # Suspicious domains
+        {'id': 'brand_misspelling', 'category': 'phishing',
+         'pattern': r'\b(amaz0n|paypa1|goog1e|faceb00k|app1e|micr0soft)\b'},
+        
+        # Personal information requests
+        {'id': 'credential_request', 'category': 'phishing',
+         'pattern': r'\b(password|username|ssn|credit card|bank account|mother maiden)\b'},
+        
+        # Suspicious attachments
+        {'id': 'dangerous_attachment', 'category': 'phishing', 'scope': 'attachments',
+         'pattern': r'\b\.(exe|bat|scr|pif|com|vbs|js|jar)\b'},
+        
+        # Generic greetings
+        {'id': 'generic_greeting', 'category': 'phishing',
+         'pattern': r'\b(dear user|dear customer|dear sir|dear madam)\b'},
+        
+        # Suspicious sender patterns
+        {'id': 'sender_suspicious_tld', 'category': 'phishing', 'check': 'sender_tld',
+         'pattern': r'from:\s*[^\s]*@[^\s]*\.(tk|ml|ga|cf|gq|xyz|top|club|online|site)'},
+        
+        # Marketing keywords
+        {'id': 'marketing', 'category': 'spam',
+         'pattern': r'\b(free|discount|offer|limited|sale|deal|save money)\b'},
+        {'id': 'call_to_action', 'category': 'spam',
+         'pattern': r'\b(click here|buy now|order now|subscribe|unsubscribe)\b'},
+        
+        # Suspicious subject patterns
+        {'id': 'spam_products', 'category': 'spam',
+         'pattern': r'\b(viagra|cialis|weight loss|diet pills|make money fast)\b'},
+        {'id': 'windfall', 'category': 'spam',
+         'pattern': r'\b(winner|prize|lottery|inheritance|million dollars)\b'},
+        
+        # Multiple exclamation marks
+        {'id': 'exclamations', 'category': 'spam', 'pattern': r'!{2,}'},
+        
+        # All caps words
+        {'id': 'all_caps', 'category': 'spam', 'pattern': r'\b[A-Z]{4,}\b'},
+        
+        # Suspicious links
+        {'id': 'bracket_link', 'category': 'spam', 'pattern': r'\[click here\]|\[here\]|\[link\]'},
+    ]
+}
+
+
+class RulePackError(ValueError):
+    """A rule pack file is missing, malformed or fails to compile."""
+
+
+class RuleSnapshot:
+    """Immutable compiled rule set, swapped into the classifier as a whole.
+    
+    Readers take one reference to a snapshot and use it for a whole
+    message, so a concurrent swap never mixes two rule versions.
+    """
+    
+    def __init__(self, pack: Dict, source: Optional[str] = None):
+        """Validate and compile a rule pack dict."""
+        if not isinstance(pack, dict) or not isinstance(pack.get('rules'), list):
+            raise RulePackError("Rule pack must be a mapping with a 'rules' list")
+        
+        rules = []
+        for position, rule in enumerate(pack['rules']):
+            if not isinstance(rule, dict) or not rule.get('id') or not rule.get('pattern'):
+                raise RulePackError(f"Rule #{position + 1} needs an 'id' and a 'pattern'")
+            if rule.get('category') not in CATEGORIES:
+                raise RulePackError(f"Rule {rule['id']}: category must be one of {CATEGORIES}")
+            if rule.get('scope', 'text') not in SCOPES:
+                raise RulePackError(f"Rule {rule['id']}: scope must be one of {SCOPES}")
+            if rule.get('check') is not None and rule['check'] not in URL_CHECKS:
+                raise RulePackError(f"Rule {rule['id']}: check must be one of {URL_CHECKS}")
+            rules.append(rule)
+        
+        ids = [str(rule['id']) for rule in rules]
+        duplicates = sorted(rule_id for rule_id, count in Counter(ids).items() if count > 1)
+        if duplicates:
+            raise RulePackError(f"Duplicate rule ids: {', '.join(duplicates)}")
+        reserved = sorted(RESERVED_RULE_IDS.intersection(ids))
+        if reserved:
+            raise RulePackError(f"Reserved rule ids: {', '.join(reserved)}")
+        
+        # Phishing rules come first so their matches are reported first
+        rules.sort(key=lambda rule: CATEGORIES.index(rule['category']))
+        try:
+            self.engine = RuleEngine([(rule['category'].capitalize(), rule['pattern']) for rule in rules])
+        except Exception as e:
+            raise RulePackError(f"Rule pack does not compile: {e}") from e
+        
+        self.source = source
+        self.version = str(pack.get('version') or self.engine.version)
+        self.rule_ids: Tuple[str, ...] = tuple(str(rule['id']) for rule in rules)
+        
+        # Results carry rule ids; this is the only place their text lives
+        self.descriptions: Dict[str, str] = {
+            rule_id: str(rule.get('description') or description)
+            for rule_id, rule, description in zip(self.rule_ids, rules, self.engine.descriptions)
+        }
+        self.loaded_at = time.time()
+        
+        # Rules answered by the URL index, which parses each URL once
+        # instead of running these regexes
+        self.url_rules: Dict[str, int] = {
+            rule['check']: index for index, rule in enumerate(rules) if rule.get('check')
+        }
+        checked = frozenset(self.url_rules.values())
+        self.text_rules: FrozenSet[int] = frozenset(range(len(rules))) - checked
+        
+        # Part of a raw MIME message each remaining rule applies to; the
+        # rest only see the subject and body
+        self.rule_scopes: Dict[str, FrozenSet[int]] = {
+            scope: frozenset(
+                index for index in self.text_rules if rules[index].get('scope', 'text') == scope
+            )
+            for scope in SCOPES
+        }
+        
+        # Compile the alternations used on every message now rather than
+        # on the first request after a swap
+        self.engine.prepare(self.text_rules)
+        for indices in self.rule_scopes.values():
+            self.engine.prepare(indices)
+    
+    def patterns(self, category: str) -> List[str]:
+        """Patterns of one category, in rule order."""
+        label = category.capitalize()
+        return [pattern for rule_label, pattern in self.engine.rules if rule_label == label]
+
+
+def load_rule_pack(path: str) -> Dict:
+    """Read a JSON or YAML (.yaml/.yml, needs PyYAML) rule pack file."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError as e:
+                    raise RulePackError("YAML rule packs need PyYAML. Run: pip install pyyaml") from e
+                return yaml.safe_load(f)
+            return json.load(f)
+    except RulePackError:
+        raise
+    except Exception as e:
+        raise RulePackError(f"Cannot read rule pack {path}: {e}") from e
+
+
+def compile_rule_pack(path: Optional[str] = None) -> RuleSnapshot:
+    """Snapshot of the pack at path, or of the built-in rules."""
+    if path is None:
+        return RuleSnapshot(DEFAULT_RULE_PACK)
+    return RuleSnapshot(load_rule_pack(path), source=path)
+
+
+class RulePackWatcher:
+    """Daemon thread recompiling a rule pack whenever its file changes.
+    
+    The file is polled every interval seconds. A changed pack is compiled
+    on this thread and handed to on_update; a pack that fails to load
+    is reported and the current rules stay in place.
+    """
+    
+    def __init__(self, path: str, on_update: Callable[[RuleSnapshot], None], interval: float = 5.0):
+        self.path = path
+        self.on_update = on_update
+        self.interval = interval
+        self._signature = self.file_signature()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rule-pack-watcher", daemon=True)
+    
+    def file_signature(self) -> Optional[Tuple[int, int]]:
+        """(mtime_ns, size) of the pack file, or None if it is missing."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def start(self) -> 'RulePackWatcher':
+        """Start polling in the background."""
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop polling after the current check."""
+        self._stop.set()
+    
+    def check(self) -> bool:
+        """Reload if the file changed since the last check; True if swapped."""
+        signature = self.file_signature()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            snapshot = compile_rule_pack(self.path)
+        except RulePackError as e:
+            print(f"⚠️  Keeping current rules: {e}")
+            return False
+        self.on_update(snapshot)
+        return True
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Validate a rule pack, or export the built-in rules as a starting pack."""
+    parser = argparse.ArgumentParser(description="Smart Email Guardian rule packs")
+    parser.add_argument("pack", nargs="?", help="Rule pack file to validate")
+    parser.add_argument("--export-default", metavar="FILE",
+                        help="Write the built-in rules as a JSON rule pack")
+    args = parser.parse_args(argv)
+    
+    if args.export_default:
+        with open(args.export_default, 'w', encoding='utf-8') as f:
+            json.dump(DEFAULT_RULE_PACK, f, indent=2)
+        print(f"✅ Wrote {len(DEFAULT_RULE_PACK['rules'])} rules to {args.export_default}")
+        return 0
+    
+    try:
+        snapshot = compile_rule_pack(args.pack)
+    except RulePackError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"✅ Rule pack {snapshot.version}: {len(snapshot.rule_ids)} rules "
+          f"({len(snapshot.url_rules)} answered by the URL index)")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Stage Metrics
+Monotonic per-stage stopwatch used by the classifier, and a rolling
+latency sink that timing hooks can feed for p50/p95/p99 reporting.
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Sequence
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Linearly interpolated percentile of samples (0-100)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class StageTimer:
+    """Stopwatch splitting one classification into consecutive stages.
+    
+    Each lap charges the time since the previous lap (or the start) to a
+    stage, so stages never overlap and add up to elapsed(). Uses
+    time.perf_counter, which is monotonic and high resolution.
+    """
+    
+    def __init__(self, start: Optional[float] = None):
+        self.start = self.mark = time.perf_counter() if start is None else start
+        self.stages: Dict[str, float] = {}
+    
+    def lap(self, stage: str):
+        """Charge the time since the last lap to stage (accumulating)."""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.mark
+        self.mark = now
+    
+    def elapsed(self) -> float:
+        """Seconds since the timer started."""
+        return time.perf_counter() - self.start
+
+
+class StageLatencyStats:
+    """Timing hook keeping the last window samples of every stage.
+    
+    Register it with EmailGuardian.add_timing_hook; summary() reports
+    per-stage percentiles in milliseconds. Safe to feed from several
+    threads.
+    """
+    
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+    
+    def __call__(self, stage_timings: Dict[str, float], result: Dict):
+        total = result.get('processing_time', sum(stage_timings.values()))
+        with self._lock:
+            for stage, seconds in (*stage_timings.items(), ('total', total)):
+                samples = self._samples.get(stage)
+                if samples is None:
+                    samples = self._samples[stage] = deque(maxlen=self.window)
+                samples.append(seconds)
+    
+    def summary(self) -> Dict[str, Dict]:
+        """Per-stage sample count and p50/p95/p99 latency in milliseconds."""
+        with self._lock:
+            snapshot = {stage: list(samples) for stage, samples in self._samples.items()}
+        report = {}
+        for stage, samples in snapshot.items():
+            report[stage] = {'count': len(samples)}
+            for pct in PERCENTILES:
+                report[stage][f'p{pct}_ms'] = percentile(samples, pct) * 1000
+        return report
+    
+    def clear(self):
+        """Drop all samples."""
+        with self._lock:
+            self._samples.clear()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - Text Normalizer
+Strips HTML, decodes entities, case-folds and collapses whitespace in one
+scan of the markup, optionally mapping every output character back to its
+position in the original text.
+"""
+
+import re
+import html
+from typing import List, Tuple
+
+# <script>/<style> blocks with their bodies, comments, then any other tag
+MARKUP_RE = re.compile(
+    r'<(?:script|style)\b[^>]*>.*?</(?:script|style)\s*>|<!--.*?-->|<[^>]+>',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Same entity syntax html.unescape() accepts
+ENTITY_RE = re.compile(r'&(#[0-9]+;?|#[xX][0-9a-fA-F]+;?|[^\t\n\f <&#;]{1,32};?)')
+
+
+def normalize_text(text: str) -> str:
+    """Return text without markup, lowercased, with whitespace collapsed.
+    
+    Each step is a C-level pass and steps that cannot change the text
+    (no '<', no '&') are skipped, so plain-text mail costs a lower() and
+    a split/join.
+    """
+    if '<' in text:
+        text = ''.join(MARKUP_RE.split(text))
+    if '&' in text:
+        text = html.unescape(text)
+    return ' '.join(text.lower().split())
+
+
+def normalize_with_offsets(text: str) -> Tuple[str, List[int]]:
+    """Normalize like normalize_text and map output back to the original.
+    
+    offsets[i] is the index in text of the character that produced
+    output character i. Decoded entities map to the '&' that started
+    them and collapsed spaces to the first whitespace character of
+    their run.
+    """
+    chars: List[str] = []
+    offsets: List[int] = []
+    pending_space = -1
+    
+    def emit(char: str, position: int):
+        nonlocal pending_space
+        if char.isspace():
+            if chars and pending_space < 0:
+                pending_space = position
+            return
+        if pending_space >= 0:
+            chars.append(' ')
+            offsets.append(pending_space)
+            pending_space = -1
+        chars.append(char)
+        offsets.append(position)
+    
+    # Markup removal first, remembering where each kept character came from
+    kept: List[str] = []
+    positions: List[int] = []
+    position = 0
+    for markup in MARKUP_RE.finditer(text):
+        kept.append(text[position:markup.start()])
+        positions.extend(range(position, markup.start()))
+        position = markup.end()
+    kept.append(text[position:])
+    positions.extend(range(position, len(text)))
+    stripped = ''.join(kept)
+    
+    position = 0
+    for entity in ENTITY_RE.finditer(stripped):
+        for i in range(position, entity.start()):
+            emit(stripped[i], positions[i])
+        for char in html.unescape(entity.group()):
+            emit(char, positions[entity.start()])
+        position = entity.end()
+    for i in range(position, len(stripped)):
+        emit(stripped[i], positions[i])
+    
+    joined = ''.join(chars)
+    lowered = joined.lower()
+    if len(lowered) != len(joined):
+        # A few characters lowercase to several (e.g. 'İ' -> 'i̇')
+        offsets = [
+            offset for char, offset in zip(chars, offsets) for _ in range(len(char.lower()))
+        ]
+    return lowered, offsets
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Smart Email Guardian - URL Index
+Extracts URLs and sender domains once per message and checks each host
+against a suspicious-TLD set, an IP-literal test and domain allow/deny
+lists, all with constant-time set lookups.
+"""
+
+import re
+import ipaddress
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from lookalike import LookalikeIndex
+
+# TLDs flagged by the original URL and sender regex rules
+SUSPICIOUS_TLDS = frozenset({'tk', 'ml', 'ga', 'cf', 'gq', 'xyz', 'top', 'club', 'online', 'site'})
+
+# Whole URL and its host (userinfo and port excluded) in one match
+URL_RE = re.compile(
+    r'https?://(?:[^\s/?#@<>"\'()]*@)?(\[[0-9a-f:.]+\]|[^\s/?#:@<>"\'()]+)[^\s<>"\'()]*',
+    re.IGNORECASE
+)
+SENDER_RE = re.compile(r'from:\s*[^\s@]*@([^\s<>"\',;]+)', re.IGNORECASE)
+HEX_HOST_RE = re.compile(r'0x[0-9a-f]+')
+
+# Trailing punctuation that usually ends the sentence, not the URL
+TRAILING_PUNCTUATION = '.,;:!?\'"]>'
+
+
+def load_domains(path: str) -> Iterator[str]:
+    """Yield domains from a list file: one per line, '#' starts a comment.
+    
+    Hosts-file lines ("0.0.0.0 example.com") are accepted too.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                domain = normalize_host(line.split()[-1])
+                if domain:
+                    yield domain
+
+
+def normalize_host(host: str) -> str:
+    """Lowercase, strip brackets and trailing dots, IDNA-encode."""
+    host = host.strip().lower().strip('[]').rstrip('.')
+    if host.isascii():
+        return host
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+def is_ip_literal(host: str) -> bool:
+    """True for dotted/IPv6 addresses and the decimal or hex forms browsers accept."""
+    if not host or not (host[0].isdigit() or ':' in host):
+        return False
+    if host.isdigit() or HEX_HOST_RE.fullmatch(host):
+        return True
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class UrlIndex:
+    """Host checks against a suspicious-TLD set and domain allow/deny sets.
+    
+    A host is looked up together with each parent domain, so listing
+    example.com also covers login.example.com; a lookup costs one set
+    probe per label, independent of the list sizes. Hosts imitating a
+    protected brand are reported through the lookalike index. Allow-listed
+    hosts are reported but never flagged.
+    """
+    
+    def __init__(self, deny_domains: Iterable[str] = (), allow_domains: Iterable[str] = (),
+                 suspicious_tlds: Iterable[str] = SUSPICIOUS_TLDS,
+                 lookalikes: Optional[LookalikeIndex] = None):
+        """Build the index from already-normalized domain iterables."""
+        self.deny_domains = set(deny_domains)
+        self.allow_domains = set(allow_domains)
+        self.suspicious_tlds = frozenset(suspicious_tlds)
+        self.lookalikes = lookalikes if lookalikes is not None else LookalikeIndex()
+    
+    @classmethod
+    def from_files(cls, deny_file: Optional[str] = None, allow_file: Optional[str] = None,
+                   brand_file: Optional[str] = None) -> 'UrlIndex':
+        """Load deny/allow/brand lists from local files (any may be omitted)."""
+        return cls(
+            load_domains(deny_file) if deny_file else (),
+            load_domains(allow_file) if allow_file else (),
+            lookalikes=LookalikeIndex(load_domains(brand_file)) if brand_file else None
+        )
+    
+    def listing(self, host: str) -> Optional[str]:
+        """Return 'allow', 'deny' or None for host or its nearest listed parent."""
+        labels = host.split('.')
+        for i in range(len(labels) - 1):
+            domain = '.'.join(labels[i:])
+            if domain in self.allow_domains:
+                return 'allow'
+            if domain in self.deny_domains:
+                return 'deny'
+        return None
+    
+    def check_host(self, host: str) -> Dict:
+        """Structured findings for one host."""
+        host = normalize_host(host)
+        ip_literal = is_ip_literal(host)
+        tld = '' if ip_literal else host.rsplit('.', 1)[-1]
+        listing = None if ip_literal else self.listing(host)
+        allowed = listing == 'allow'
+        lookalike_of = None if ip_literal or allowed else self.lookalikes.match(host)
+        return {
+            'host': host,
+            'tld': tld,
+            'ip_literal': ip_literal,
+            'suspicious_tld': tld in self.suspicious_tlds and not allowed,
+            'denied': listing == 'deny',
+            'allowed': allowed,
+            'lookalike_of': lookalike_of
+        }
+    
+    def analyze_urls(self, text: str) -> List[Dict]:
+        """Check the host of each distinct URL in text, each host once."""
+        results = []
+        seen = set()
+        hosts: Dict[str, Dict] = {}
+        for match in URL_RE.finditer(text):
+            url = match.group().rstrip(TRAILING_PUNCTUATION)
+            if url in seen:
+                continue
+            seen.add(url)
+            host = match.group(1).rstrip(TRAILING_PUNCTUATION)
+            if host not in hosts:
+                hosts[host] = self.check_host(host)
+            results.append({'url': url, **hosts[host]})
+        return results
+    
+    def analyze_senders(self, text: str) -> List[Dict]:
+        """Check the domain of every 'from: user@domain' address in text."""
+        results = []
+        seen = set()
+        for domain in SENDER_RE.findall(text):
+            domain = domain.rstrip(TRAILING_PUNCTUATION)
+            if domain and domain not in seen:
+                seen.add(domain)
+                results.append(self.check_host(domain))
+        return results
@@ -10,14 +10,22 @@ import json
 import uuid
 import hashlib
 import sqlite3
+import math
+import time
+import queue
+import asyncio
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 import secrets
 import re
 
 from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, validator
 import uvicorn
 
@@ -26,6 +34,8 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai'))
 
 try:
     from email_guard import EmailGuardian
+    from stage_metrics import StageLatencyStats
+    from cpu_tuning import available_cpus, claim_worker_slot, cpu_ids, parse_cpu_list, worker_cpus
 except ImportError:
     print("Error: Could not import EmailGuardian. Make sure ai/email_guard.py exists.")
     sys.exit(1)
@@ -57,6 +67,9 @@ class EmailScanResponse(BaseModel):
     explanation: str
     risk_level: str
     suspicious_patterns: List[str]
+    rule_ids: List[str] = []
+    url_results: List[Dict] = []
+    rule_pack_version: Optional[str] = None
     timestamp: str
     processing_time_ms: int
 
@@ -90,15 +103,89 @@ class APIKeyRequest(BaseModel):
 
 # Database setup
 class Database:
-    """Simple SQLite database manager."""
+    """SQLite database manager with one persistent connection per thread.
     
-    def __init__(self, db_path: str = "email_guardian.db"):
+    Connections run in WAL mode, so /history readers never wait for a
+    writer, with synchronous=NORMAL, which syncs at checkpoints instead of
+    on every commit. Each connection keeps its prepared statements in the
+    sqlite3 statement cache, so repeated queries are only parsed once.
+    """
+    
+    # Prepared statements kept per connection
+    CACHED_STATEMENTS = 64
+    
+    # Seconds a writer waits for another writer's lock
+    BUSY_TIMEOUT = 5.0
+    
+    # Insert shared by single and batched history writes
+    SCAN_INSERT = '''
+        INSERT INTO scan_history 
+        (scan_id, user_id, email_text_hash, classification, confidence, 
+         explanation, risk_level, suspicious_patterns, timestamp, 
+         processing_time_ms, ip_address)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    # Schema changes by the version (PRAGMA user_version) they bring a
+    # database to; migrate() applies each one once. Version 1 is the
+    # original tables.
+    MIGRATIONS = {
+        # History pages are read newest first, per user or overall; these
+        # serve both the ORDER BY and keyset ranges without a sort
+        2: (
+            '''CREATE INDEX IF NOT EXISTS idx_scan_history_user_time
+               ON scan_history (user_id, timestamp, scan_id)''',
+            '''CREATE INDEX IF NOT EXISTS idx_scan_history_time
+               ON scan_history (timestamp, scan_id)''',
+        ),
+    }
+    SCHEMA_VERSION = max(MIGRATIONS)
+    
+    def __init__(self, db_path: str = "email_guardian.db", key_cache_ttl: float = 60.0):
         self.db_path = db_path
+        self.key_cache_ttl = key_cache_ttl
+        self._key_cache: Dict[str, float] = {}   # key hash -> monotonic expiry
+        self._last_used: Dict[str, str] = {}     # key hash -> unwritten last_used
+        self._key_lock = threading.Lock()
+        self._key_generation = 0                 # bumped by every deactivation
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
         self.init_db()
     
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection, opened on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only close() touches it from another thread
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.BUSY_TIMEOUT,
+                cached_statements=self.CACHED_STATEMENTS,
+                check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    def ping(self):
+        """Run a trivial query; raises if the database is unusable."""
+        self.connection().execute("SELECT 1").fetchone()
+    
+    def close(self):
+        """Close every thread's connection (the last one checkpoints the WAL)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+    
     def init_db(self):
         """Initialize database tables."""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connection()
         cursor = conn.cursor()
         
         # Scan history table
@@ -132,20 +219,25 @@ class Database:
         ''')
         
         conn.commit()
-        conn.close()
+        self.migrate()
     
-    def save_scan_result(self, scan_data: Dict):
-        """Save scan result to database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO scan_history 
-            (scan_id, user_id, email_text_hash, classification, confidence, 
-             explanation, risk_level, suspicious_patterns, timestamp, 
-             processing_time_ms, ip_address)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+    def migrate(self):
+        """Apply the schema migrations this database has not seen yet."""
+        conn = self.connection()
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version in sorted(self.MIGRATIONS):
+            if version <= current:
+                continue
+            # Index builds on a large history table take a while, once
+            with conn:
+                for statement in self.MIGRATIONS[version]:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version}")
+    
+    @staticmethod
+    def scan_row(scan_data: Dict) -> tuple:
+        """Parameters of SCAN_INSERT for one scan result."""
+        return (
             scan_data['scan_id'],
             scan_data.get('user_id'),
             scan_data['email_text_hash'],
@@ -157,33 +249,52 @@ class Database:
             scan_data['timestamp'],
             scan_data['processing_time_ms'],
             scan_data.get('ip_address')
-        ))
+        )
+    
+    def save_scan_result(self, scan_data: Dict):
+        """Save scan result to database."""
+        conn = self.connection()
         
-        conn.commit()
-        conn.close()
+        # Commits, or rolls back so the persistent connection stays usable
+        with conn:
+            conn.execute(self.SCAN_INSERT, self.scan_row(scan_data))
+    
+    def save_scan_results(self, records: List[Dict]):
+        """Save several scan results in one transaction (all or none)."""
+        conn = self.connection()
+        
+        with conn:
+            conn.executemany(self.SCAN_INSERT, [self.scan_row(record) for record in records])
     
-    def get_scan_history(self, user_id: Optional[str] = None, limit: int = 10, offset: int = 0) -> List[Dict]:
-        """Retrieve scan history."""
-        conn = sqlite3.connect(self.db_path)
+    def get_scan_history(self, user_id: Optional[str] = None, limit: int = 10, offset: int = 0,
+                         after: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """Retrieve scan history, newest first.
+        
+        after is the (timestamp, scan_id) of the last row of the previous
+        page; with it the page starts right there in the index instead of
+        skipping offset rows.
+        """
+        conn = self.connection()
         cursor = conn.cursor()
         
+        conditions = []
+        params: List = []
         if user_id:
-            cursor.execute('''
-                SELECT scan_id, classification, confidence, risk_level, 
-                       timestamp, processing_time_ms
-                FROM scan_history 
-                WHERE user_id = ?
-                ORDER BY timestamp DESC 
-                LIMIT ? OFFSET ?
-            ''', (user_id, limit, offset))
-        else:
-            cursor.execute('''
-                SELECT scan_id, classification, confidence, risk_level, 
-                       timestamp, processing_time_ms
-                FROM scan_history 
-                ORDER BY timestamp DESC 
-                LIMIT ? OFFSET ?
-            ''', (limit, offset))
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if after is not None:
+            conditions.append("(timestamp, scan_id) < (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        cursor.execute(f'''
+            SELECT scan_id, classification, confidence, risk_level, 
+                   timestamp, processing_time_ms
+            FROM scan_history 
+            {where}
+            ORDER BY timestamp DESC, scan_id DESC 
+            LIMIT ? OFFSET ?
+        ''', (*params, limit, offset))
         
         results = []
         for row in cursor.fetchall():
@@ -196,7 +307,6 @@ class Database:
                 'processing_time_ms': row[5]
             })
         
-        conn.close()
         return results
     
     def create_api_key(self, name: str, description: Optional[str] = None) -> str:
@@ -205,44 +315,381 @@ class Database:
         key_hash = hashlib.sha256(key.encode()).hexdigest()
         key_id = str(uuid.uuid4())
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO api_keys (key_id, key_hash, name, description, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (key_id, key_hash, name, description, datetime.utcnow().isoformat()))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor.execute('''
+                INSERT INTO api_keys (key_id, key_hash, name, description, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key_id, key_hash, name, description, datetime.utcnow().isoformat()))
         
         return key
     
     def verify_api_key(self, key: str) -> bool:
-        """Verify an API key."""
+        """Verify an API key.
+        
+        Valid keys are cached for key_cache_ttl seconds, so repeated
+        requests cost a hash and a dict lookup. last_used is recorded in
+        memory and written by flush_last_used().
+        """
         key_hash = hashlib.sha256(key.encode()).hexdigest()
+        now = time.monotonic()
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._key_lock:
+            expires = self._key_cache.get(key_hash)
+            if expires is not None and expires > now:
+                self._last_used[key_hash] = datetime.utcnow().isoformat()
+                return True
+            generation = self._key_generation
+        
+        active = self._lookup_key(key_hash)
+        
+        with self._key_lock:
+            if active:
+                # A key deactivated since the lookup must not be cached again
+                if self.key_cache_ttl > 0 and generation == self._key_generation:
+                    self._key_cache[key_hash] = now + self.key_cache_ttl
+                self._last_used[key_hash] = datetime.utcnow().isoformat()
+            else:
+                self._key_cache.pop(key_hash, None)
+        
+        return active
+    
+    def _lookup_key(self, key_hash: str) -> bool:
+        """True if an active key has this hash."""
+        cursor = self.connection().cursor()
         
         cursor.execute('''
             SELECT key_id FROM api_keys 
             WHERE key_hash = ? AND is_active = 1
         ''', (key_hash,))
         
-        result = cursor.fetchone()
+        return cursor.fetchone() is not None
+    
+    def deactivate_api_key(self, key_id: str) -> bool:
+        """Deactivate a key and drop it from this process's key cache.
         
-        if result:
-            # Update last used timestamp
-            cursor.execute('''
-                UPDATE api_keys 
-                SET last_used = ? 
-                WHERE key_hash = ?
-            ''', (datetime.utcnow().isoformat(), key_hash))
-            conn.commit()
+        Other processes sharing the database notice within key_cache_ttl.
+        """
+        conn = self.connection()
+        with conn:
+            row = conn.execute("SELECT key_hash FROM api_keys WHERE key_id = ?", (key_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("UPDATE api_keys SET is_active = 0 WHERE key_id = ?", (key_id,))
+        
+        # Bumped after the commit: lookups that started earlier may have
+        # seen the key active and must not cache it
+        with self._key_lock:
+            self._key_generation += 1
+            self._key_cache.pop(row[0], None)
+            self._last_used.pop(row[0], None)
+        return True
+    
+    def flush_last_used(self) -> int:
+        """Write the coalesced last_used times in one UPDATE batch."""
+        with self._key_lock:
+            pending, self._last_used = self._last_used, {}
+        if not pending:
+            return 0
         
-        conn.close()
-        return result is not None
+        conn = self.connection()
+        try:
+            with conn:
+                conn.executemany('''
+                    UPDATE api_keys 
+                    SET last_used = ? 
+                    WHERE key_hash = ?
+                ''', [(last_used, key_hash) for key_hash, last_used in pending.items()])
+        except sqlite3.Error:
+            # Keep them for the next flush unless the key was used again since
+            with self._key_lock:
+                for key_hash, last_used in pending.items():
+                    self._last_used.setdefault(key_hash, last_used)
+            raise
+        return len(pending)
+
+
+def encode_history_cursor(timestamp: str, scan_id: str) -> str:
+    """Opaque /history page token pointing after the given row."""
+    raw = json.dumps([timestamp, scan_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_history_cursor(token: str) -> Tuple[str, str]:
+    """(timestamp, scan_id) of an encode_history_cursor token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, scan_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid history cursor") from None
+    if not isinstance(timestamp, str) or not isinstance(scan_id, str):
+        raise ValueError("Invalid history cursor")
+    return timestamp, scan_id
+
+
+class ScanWriter:
+    """Write-behind queue for scan_history inserts.
+    
+    /scan hands its record to a bounded queue and returns; a daemon thread
+    inserts queued records with executemany, one transaction per batch of
+    batch_size records or per flush_interval seconds, whichever comes
+    first. submit never blocks: when the queue is full (or the writer is
+    closed) it returns False and the caller writes the record with
+    write(), off the event loop, so a slow disk slows scans down instead
+    of losing history. close() drains the queue. The counters are shared
+    by the writer thread and write() callers, so they are updated under a
+    lock.
+    """
+    
+    # Queue markers: end the current batch / stop the writer after it
+    _FLUSH = object()
+    _STOP = object()
+    
+    def __init__(self, db: Database, batch_size: int = 100, flush_interval: float = 0.2,
+                 max_queue: int = 10000):
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.overflows = 0
+        self.failed = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="scan-writer", daemon=True)
+        self._thread.start()
+    
+    def submit(self, scan_data: Dict) -> bool:
+        """Queue one scan result for the next batch; False if it was not queued."""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(scan_data)
+        except queue.Full:
+            with self._lock:
+                self.overflows += 1
+            return False
+        return True
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every record queued so far is written.
+        
+        Returns False if that takes longer than timeout seconds. Never
+        blocks on a full queue: the marker that ends the current batch
+        early is only queued if there is room, and a full queue fills the
+        batch anyway.
+        """
+        if self._closed:
+            return True
+        try:
+            self._queue.put_nowait(self._FLUSH)
+        except queue.Full:
+            pass
+        
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+    
+    def close(self, timeout: Optional[float] = None):
+        """Write all queued records and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        
+        # Records that raced past the stop marker
+        leftovers = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not self._FLUSH and record is not self._STOP:
+                leftovers.append(record)
+        if leftovers:
+            self.write(leftovers)
+    
+    def stats(self) -> Dict[str, int]:
+        """Queue depth and write counters."""
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'written': self.written,
+                'overflows': self.overflows,
+                'failed': self.failed
+            }
+    
+    def write(self, records: List[Dict]):
+        """Insert records now, on the calling thread."""
+        try:
+            self.db.save_scan_results(records)
+            with self._lock:
+                self.written += len(records)
+            return
+        except Exception as e:
+            if len(records) == 1:
+                with self._lock:
+                    self.failed += 1
+                print(f"⚠️  Could not save scan {records[0].get('scan_id')}: {e}")
+                return
+        
+        # One bad record rolls back its batch; retry the rest one by one
+        for record in records:
+            self.write([record])
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            markers = 0
+            record = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if record is self._STOP or record is self._FLUSH:
+                    markers += 1
+                    stopping = record is self._STOP
+                    break
+                batch.append(record)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            
+            if batch:
+                self.write(batch)
+            for _ in range(len(batch) + markers):
+                self._queue.task_done()
+
+
+class InferenceQueueFull(Exception):
+    """Every inference worker is busy and the wait queue is full."""
+    
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """Runs classification on worker threads, off the event loop.
+    
+    Torch releases the GIL during inference, so a thread pool keeps the
+    loop free for /health and /history while a model call runs. At most
+    workers classifications run at once and max_queue more wait; beyond
+    that run() raises InferenceQueueFull with a Retry-After estimate
+    instead of letting requests pile up.
+    """
+    
+    # Weight of the newest call in the average service time
+    SMOOTHING = 0.1
+    
+    def __init__(self, workers: int, max_queue: int):
+        if workers < 1 or max_queue < 0:
+            raise ValueError("workers must be at least 1 and max_queue non-negative")
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.average_seconds = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+    
+    async def run(self, func, *args):
+        """Await func(*args) on a worker thread."""
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise InferenceQueueFull(self.retry_after())
+            self.in_flight += 1
+        
+        # The slot is released when the call ends (or is cancelled before
+        # starting), not when an abandoned request stops awaiting it
+        future = self._executor.submit(self._timed, func, *args)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+    
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is likely worked off."""
+        backlog = self.in_flight / self.workers * self.average_seconds
+        return max(1, math.ceil(backlog))
+    
+    def stats(self) -> Dict:
+        """Queue depth and counters."""
+        with self._lock:
+            in_flight = self.in_flight
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'running': min(in_flight, self.workers),
+            'queued': max(0, in_flight - self.workers),
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'average_ms': self.average_seconds * 1000
+        }
+    
+    def close(self):
+        """Finish running calls and stop the workers."""
+        self._executor.shutdown(wait=True)
+    
+    def _timed(self, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.completed += 1
+                if self.completed == 1:
+                    self.average_seconds = elapsed
+                else:
+                    self.average_seconds += self.SMOOTHING * (elapsed - self.average_seconds)
+    
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def default_inference_workers(intra_op_threads: int) -> int:
+    """Inference threads that fit the CPUs next to intra_op_threads each.
+    
+    With torch's default pool (one thread per core) a single call already
+    uses every core, so one worker.
+    """
+    if intra_op_threads <= 0:
+        return 1
+    return max(1, available_cpus() // intra_op_threads)
+
+
+def worker_cpu_affinity() -> Optional[Union[str, List[int]]]:
+    """CPUs this API process is pinned to.
+    
+    EMAIL_GUARD_CPU_AFFINITY alone pins every process to the same list.
+    With EMAIL_GUARD_AFFINITY_WORKERS=N (the uvicorn --workers count),
+    each worker claims its own slot and is pinned to a disjoint 1/N of
+    that list (or of all CPUs).
+    """
+    spec = os.environ.get("EMAIL_GUARD_CPU_AFFINITY")
+    workers = int(os.environ.get("EMAIL_GUARD_AFFINITY_WORKERS", 1))
+    if workers <= 1:
+        return spec
+    
+    # uvicorn workers share their supervisor as parent
+    index = claim_worker_slot(workers, f"email-guard-{os.getppid()}")
+    if index is None:
+        print(f"⚠️  No free CPU slot among {workers} workers; not splitting the CPU list")
+        return spec
+    return worker_cpus(index, workers, parse_cpu_list(spec) if spec else cpu_ids())
 
 
 # Initialize components
@@ -266,9 +713,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database and AI model
-db = Database()
-email_guardian = EmailGuardian()
+# Initialize database and AI model. The model warms up on a background
+# thread by default so the server accepts traffic (pattern-only) at once.
+db = Database(key_cache_ttl=float(os.environ.get("EMAIL_GUARD_KEY_CACHE_TTL", 60)))
+email_guardian = EmailGuardian(
+    model_loading=os.environ.get("EMAIL_GUARD_MODEL_LOADING", "background"),
+    inference_backend=os.environ.get("EMAIL_GUARD_INFERENCE_BACKEND", "torch"),
+    quantize=os.environ.get("EMAIL_GUARD_QUANTIZE", "none"),
+    deny_domains_file=os.environ.get("EMAIL_GUARD_DENY_DOMAINS"),
+    allow_domains_file=os.environ.get("EMAIL_GUARD_ALLOW_DOMAINS"),
+    brand_domains_file=os.environ.get("EMAIL_GUARD_BRAND_DOMAINS"),
+    intra_op_threads=int(os.environ.get("EMAIL_GUARD_INTRA_OP_THREADS", 0)),
+    inter_op_threads=int(os.environ.get("EMAIL_GUARD_INTER_OP_THREADS", 0)),
+    cpu_affinity=worker_cpu_affinity(),
+    rule_pack_file=os.environ.get("EMAIL_GUARD_RULE_PACK"),
+    rule_reload_interval=float(os.environ.get("EMAIL_GUARD_RULE_RELOAD_INTERVAL", 5))
+)
+
+# Scan history is written in batches behind the /scan responses
+scan_writer = ScanWriter(
+    db,
+    batch_size=int(os.environ.get("EMAIL_GUARD_HISTORY_BATCH_SIZE", 100)),
+    flush_interval=int(os.environ.get("EMAIL_GUARD_HISTORY_FLUSH_MS", 200)) / 1000,
+    max_queue=int(os.environ.get("EMAIL_GUARD_HISTORY_QUEUE_SIZE", 10000))
+)
+
+# Classification runs on its own threads so the event loop keeps serving
+# /health and /history during inference; excess requests get a 503
+inference = InferenceExecutor(
+    workers=int(os.environ.get("EMAIL_GUARD_INFERENCE_WORKERS")
+                or default_inference_workers(email_guardian.intra_op_threads)),
+    max_queue=int(os.environ.get("EMAIL_GUARD_INFERENCE_QUEUE", 32))
+)
+
+# Rolling per-stage latencies, reported by /health
+stage_latency = StageLatencyStats()
+email_guardian.add_timing_hook(stage_latency)
+
+
+# API-key last_used times are coalesced in memory and written in batches
+key_usage_interval = float(os.environ.get("EMAIL_GUARD_KEY_USAGE_FLUSH", 30))
+key_usage_stop = threading.Event()
+
+
+def flush_key_usage():
+    """Write API-key last_used times every key_usage_interval seconds."""
+    while not key_usage_stop.wait(key_usage_interval):
+        try:
+            db.flush_last_used()
+        except Exception as e:
+            print(f"⚠️  Could not record API key usage: {e}")
+
+
+threading.Thread(target=flush_key_usage, name="key-usage-flusher", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def close_database():
+    """Finish running scans, write queued history and key usage, then close the database."""
+    key_usage_stop.set()
+    inference.close()
+    scan_writer.close()
+    db.flush_last_used()
+    db.close()
+
 
 # Security
 security = HTTPBearer()
@@ -332,13 +840,19 @@ async def health_check():
     """Health check endpoint."""
     try:
         # Test database connection
-        conn = sqlite3.connect(db.db_path)
-        conn.close()
+        db.ping()
         
         return {
             "status": "healthy",
             "timestamp": datetime.utcnow().isoformat(),
             "ai_model": email_guardian.model_name,
+            "ai_model_status": email_guardian.model_status,
+            "ai_backend": email_guardian.active_backend,
+            "ai_model_ready": email_guardian.model_ready.is_set(),
+            "rule_pack_version": email_guardian.rules.version,
+            "stage_latency_ms": stage_latency.summary(),
+            "scan_writer": scan_writer.stats(),
+            "inference": inference.stats(),
             "database": "connected"
         }
     except Exception as e:
@@ -377,13 +891,13 @@ async def scan_email(
     rate_limit_check(http_request)
     
     try:
-        start_time = datetime.utcnow()
+        start_time = time.perf_counter()
         
-        # Analyze email
-        result = email_guardian.classify_email(request.email_text)
+        # Analyze email on an inference thread
+        result = await inference.run(email_guardian.classify_email, request.email_text)
         
         end_time = datetime.utcnow()
-        processing_time_ms = int((end_time - start_time).total_seconds() * 1000)
+        processing_time_ms = int((time.perf_counter() - start_time) * 1000)
         
         # Generate scan ID and prepare response
         scan_id = str(uuid.uuid4())
@@ -397,6 +911,9 @@ async def scan_email(
             explanation=result['explanation'],
             risk_level=result['risk_level'],
             suspicious_patterns=result['suspicious_patterns'],
+            rule_ids=result.get('rule_ids', []),
+            url_results=result.get('url_results', []),
+            rule_pack_version=result.get('rule_pack_version'),
             timestamp=timestamp,
             processing_time_ms=processing_time_ms
         )
@@ -411,16 +928,27 @@ async def scan_email(
             'confidence': result['confidence'],
             'explanation': result['explanation'],
             'risk_level': result['risk_level'],
-            'suspicious_patterns': result['suspicious_patterns'],
+            # Short rule ids instead of full descriptions keep rows small;
+            # rule_pack.py resolves them
+            'suspicious_patterns': result.get('rule_ids', result['suspicious_patterns']),
             'timestamp': timestamp,
             'processing_time_ms': processing_time_ms,
             'ip_address': http_request.client.host
         }
         
-        db.save_scan_result(scan_data)
+        if not scan_writer.submit(scan_data):
+            # Backpressure: the writer is behind, so this request waits for
+            # its own insert, on a worker thread rather than the event loop
+            await asyncio.to_thread(scan_writer.write, [scan_data])
         
         return response
         
+    except InferenceQueueFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many scans in progress, try again shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -438,9 +966,14 @@ async def get_scan_history(
     user_id: Optional[str] = None,
     limit: int = 10,
     offset: int = 0,
+    after: Optional[str] = None,
     api_key: str = Depends(verify_api_key)
 ):
-    """Retrieve scan history."""
+    """Retrieve scan history.
+    
+    Pages by offset, or by the next_after token of the previous page,
+    which stays fast however deep the page is.
+    """
     try:
         # Validate parameters
         if limit < 1 or limit > 100:
@@ -455,15 +988,37 @@ async def get_scan_history(
                 detail="Offset must be non-negative"
             )
         
-        history = db.get_scan_history(user_id, limit, offset)
+        if after and offset:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Use either offset or after, not both"
+            )
+        
+        try:
+            cursor = decode_history_cursor(after) if after else None
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        
+        history = db.get_scan_history(user_id, limit, offset, after=cursor)
+        
+        # Token for the following page; None once the history is exhausted
+        next_after = None
+        if len(history) == limit:
+            next_after = encode_history_cursor(history[-1]['timestamp'], history[-1]['scan_id'])
         
         return {
             "history": history,
             "count": len(history),
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_after": next_after
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -475,12 +1030,17 @@ async def get_scan_history(
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Custom HTTP exception handler."""
-    return {
-        "error": True,
-        "status_code": exc.status_code,
-        "message": exc.detail,
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={
+            "error": True,
+            "status_code": exc.status_code,
+            "message": exc.detail,
+            "timestamp": datetime.utcnow().isoformat()
+        },
+        # Keeps Retry-After on 503s
+        headers=exc.headers
+    )
 
 
 if __name__ == "__main__":
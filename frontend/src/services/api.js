@@ -48,10 +48,11 @@ export const emailAPI = {
     });
   },
 
-  // Get scan history
-  getHistory: (limit = 50, offset = 0, userId = null) => {
+  // Get scan history (pass the previous page's next_after token as after to page by cursor)
+  getHistory: (limit = 50, offset = 0, userId = null, after = null) => {
     const params = { limit, offset };
     if (userId) params.user_id = userId;
+    if (after) params.after = after;
     return api.get('/history', { params });
   },
 
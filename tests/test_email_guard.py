@@ -129,6 +129,715 @@ And an email: contact@test.com
         self.assertEqual(result['classification'], 'legitimate')
         self.assertLessEqual(result['confidence'], 0.3)
         self.assertEqual(len(result['suspicious_patterns']), 0)
+    
+    def test_preprocess_text_strips_markup_with_offsets(self):
+        """Test normalization drops script/style bodies, decodes entities and maps offsets."""
+        html_email = ("<HTML><style>p { color: red }</style><script>var x = 1 < 2;</script>"
+                      "<p>Verify&nbsp;NOW &amp;\n\n  Win</p><!-- hidden <b>note</b> -->&lt;b&gt; İt")
+        
+        clean = self.guardian.preprocess_text(html_email)
+        clean_with_offsets, offsets = self.guardian.preprocess_text(html_email, with_offsets=True)
+        
+        self.assertEqual(clean, "verify now & win<b> i̇t")
+        self.assertEqual(clean_with_offsets, clean)
+        self.assertEqual(len(offsets), len(clean))
+        self.assertEqual(html_email[offsets[0]:offsets[0] + 6], "Verify")
+        self.assertEqual(html_email[offsets[clean.index('&')]:].split(';')[0], "&amp")
+        self.assertEqual(html_email[offsets[-1]], "t")
+        self.assertEqual(self.guardian.preprocess_text("  Plain\ttext  "), "plain text")
+    
+    def test_classify_raw_email_scopes_parts(self):
+        """Test raw MIME messages skip attachments and scope rules to their part."""
+        from email.message import EmailMessage
+        
+        message = EmailMessage()
+        message['From'] = 'Support <alerts@secure-bank.tk>'
+        message['Subject'] = 'Quarterly report'
+        message.set_content("Hi team, the report is attached.")
+        message.add_alternative('<p>Hi team, see <a href="http://192.168.10.5/login">the report</a>.</p>',
+                                subtype='html')
+        message.add_attachment(b"MZ" + b"URGENT FREE WINNER " * 5000, maintype='application',
+                               subtype='octet-stream', filename='report.exe')
+        raw = message.as_bytes()
+        
+        from mime_parser import parse_raw_email
+        parsed = parse_raw_email(raw)
+        self.assertEqual(parsed['body_type'], 'plain')
+        self.assertEqual(parsed['attachments'], ['report.exe'])
+        self.assertEqual(parsed['urls'], ['http://192.168.10.5/login'])
+        self.assertEqual(parsed['senders'], [('from', 'alerts@secure-bank.tk')])
+        
+        result = self.guardian.classify_raw_email(raw)
+        patterns = " ".join(result['suspicious_patterns'])
+        self.assertIn(r'\d{1,3}\.\d{1,3}', patterns)
+        self.assertIn(r'exe|bat', patterns)
+        self.assertIn('from:', patterns)
+        self.assertNotIn('free|discount', patterns)
+        self.assertNotIn('winner|prize', patterns)
+    
+    def test_url_index_flags_hosts_and_lists(self):
+        """Test URLs are parsed once and hosts checked against TLD, IP and domain lists."""
+        from url_index import UrlIndex
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            deny_file = os.path.join(tmp, 'deny.txt')
+            allow_file = os.path.join(tmp, 'allow.txt')
+            with open(deny_file, 'w') as f:
+                f.write("# known phishing\nevil-login.com\n0.0.0.0 tracker.example\n")
+            with open(allow_file, 'w') as f:
+                f.write("trusted.tk\n")
+            index = UrlIndex.from_files(deny_file, allow_file)
+        
+        results = index.analyze_urls(
+            "go to https://Secure.Evil-Login.com/reset, or http://192.168.0.1:8080/x "
+            "or http://news.trusted.tk/a and http://prize.tk."
+        )
+        by_host = {result['host']: result for result in results}
+        
+        self.assertEqual(list(by_host), ['secure.evil-login.com', '192.168.0.1', 'news.trusted.tk', 'prize.tk'])
+        self.assertTrue(by_host['secure.evil-login.com']['denied'])
+        self.assertTrue(by_host['192.168.0.1']['ip_literal'])
+        self.assertFalse(by_host['news.trusted.tk']['suspicious_tld'])
+        self.assertTrue(by_host['prize.tk']['suspicious_tld'])
+        self.assertTrue(index.analyze_senders("from: alerts@mail.tracker.example")[0]['denied'])
+        
+        self.guardian.url_index = index
+        result = self.guardian.classify_email("Reset at https://secure.evil-login.com/reset")
+        self.assertIn("Phishing domain: secure.evil-login.com (deny-list)", result['suspicious_patterns'])
+        self.assertEqual(result['url_results'][0]['host'], 'secure.evil-login.com')
+    
+    def test_lookalike_domains_match_protected_brands(self):
+        """Test homoglyph, leetspeak and typo domains map to the brand they imitate."""
+        from lookalike import LookalikeIndex
+        
+        index = LookalikeIndex(['paypal.com', 'microsoft.com', 'amazon.com', 'ups.com'])
+        
+        self.assertEqual(index.match('paypa1.com'), 'paypal.com')
+        self.assertEqual(index.match('xn--pypal-4ve.com'), 'paypal.com')  # Cyrillic 'а'
+        self.assertEqual(index.match('rnicros0ft.net'), 'microsoft.com')
+        self.assertEqual(index.match('amazoon.com'), 'amazon.com')
+        self.assertEqual(index.match('paypa1.secure-login.tk'), 'paypal.com')
+        self.assertEqual(index.match('paypa1-verify.com'), 'paypal.com')
+        self.assertIsNone(index.match('login.paypal.com'))
+        self.assertIsNone(index.match('ups.example.com'))
+        self.assertIsNone(index.match('example.org'))
+        
+        # Brand names under other suffixes, and plain words that happen to be brands
+        defaults = LookalikeIndex()
+        for host in ('amazon.co.uk', 'google.de', 'paypal.me', 'outlook.live.com', 'apple.co',
+                     'dhl.de', 'www.ups.de', 'mail.yahoo.co.jp', 'office.mycompany.com',
+                     'officer.com', 'big-apple-bakery.com', 'chase-bank.org',
+                     # One edit from binance.com, but ordinary words
+                     'finance.example.com', 'www.finance.com', 'finance.ucla.edu', 'yahoo-finance.net'):
+            with self.subTest(host=host):
+                self.assertIsNone(defaults.match(host))
+        self.assertEqual(defaults.match('0ffice.com'), 'office.com')
+        
+        # The brand spelled out in a subdomain or hyphenated name, or under a foreign suffix
+        for host, brand in (('paypal.com.login-verify.tk', 'paypal.com'), ('paypal-login.com', 'paypal.com'),
+                            ('secure-paypal.com', 'paypal.com'), ('amazon-security.net', 'amazon.com'),
+                            ('microsoft-support.com', 'microsoft.com'),
+                            ('accounts.google.com.evil.ru', 'google.com'), ('paypal.tk', 'paypal.com')):
+            with self.subTest(host=host):
+                self.assertEqual(defaults.match(host), brand)
+        
+        result = self.guardian.classify_email(
+            "Your order has shipped: https://www.amazon.co.uk/orders and https://amazon.de/track")
+        self.assertNotIn('lookalike_domain', result['rule_ids'])
+        
+        result = self.guardian.pattern_classify("see http://paypa1.com and http://paypa1.net/login")
+        self.assertEqual(result['rule_ids'].count('lookalike_domain'), 1)
+        self.assertEqual(len(result['findings']), 2)
+        
+        result = self.guardian.classify_email("Confirm at https://secure.paypa1-support.com/login")
+        self.assertIn("Phishing domain: secure.paypa1-support.com (lookalike of paypal.com)",
+                      result['suspicious_patterns'])
+    
+    def test_rule_engine_matches_individual_search(self):
+        """Test the compiled rule engine reports the same rules as re.search."""
+        import re
+        
+        texts = [
+            "urgent: verify your credit card and bank account password now!!!",
+            "dear customer, you are a winner! visit http://prize.tk/claim [here]",
+            "hi john, see you at the meeting",
+            "",
+        ]
+        
+        for text in texts:
+            with self.subTest(text=text):
+                expected = [
+                    f"Phishing pattern: {p}" for p in self.guardian.phishing_patterns
+                    if re.search(p, text, re.IGNORECASE)
+                ] + [
+                    f"Spam pattern: {p}" for p in self.guardian.spam_patterns
+                    if re.search(p, text, re.IGNORECASE)
+                ]
+                result = self.guardian.pattern_classify(text)
+                self.assertEqual(result['patterns'], expected)
+    
+    def test_rule_engine_hits_do_not_compile_new_regexes(self):
+        """Test structural hits are confirmed without compiling new alternations."""
+        from rule_engine import RuleEngine
+        
+        engine = RuleEngine([
+            ('Phishing', r'https?://\S+'),
+            ('Phishing', r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}'),
+            ('Spam', r'!{3,}'),
+            ('Spam', r'\$\d+'),
+        ])
+        
+        self.assertEqual(engine.match("win $100!!! at http://10.0.0.1/x"), [0, 1, 2, 3])
+        self.assertEqual(engine.match("http://10.0.0.1/x", only=[1, 2]), [1])
+        self.assertEqual(engine.match("nothing here"), [])
+        self.assertEqual(len(engine._regexes), 2)
+    
+    def test_keyword_automaton_word_boundaries(self):
+        """Test literal keywords respect regex word boundaries and phrases."""
+        from keyword_automaton import KeywordAutomaton
+        
+        automaton = KeywordAutomaton()
+        automaton.update(['free', 'verify now', 'paypa1'], 0)
+        automaton.update([f'brand{i}' for i in range(5000)], 1)
+        
+        self.assertEqual(automaton.match("totally free!"), {0})
+        self.assertEqual(automaton.match("please VERIFY NOW"), {0})
+        self.assertEqual(automaton.match("freedom to verify  now"), set())
+        self.assertEqual(automaton.match("log in to brand4321 today"), {1})
+        self.assertEqual(automaton.match("brand4321x"), set())
+    
+    def test_classify_batch_preserves_order(self):
+        """Test batched classification returns results in input order."""
+        def fake_classifier(inputs, batch_size=None):
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            return [
+                {'label': 'toxic' if 'hate' in text else 'non-toxic', 'score': 0.9}
+                for text in inputs
+            ]
+        
+        self.guardian.classifier = MagicMock(side_effect=fake_classifier)
+        texts = ["i hate you " * 20, "hello", "see you soon, " * 5, "hate mail"]
+        
+        results = self.guardian.classify_batch(texts, batch_size=2)
+        
+        self.assertEqual(self.guardian.classifier.call_count, 2)
+        self.assertEqual(len(results), len(texts))
+        for text, result in zip(texts, results):
+            with self.subTest(text=text):
+                expected = self.guardian.classify_email(text)
+                self.assertEqual(result['classification'], expected['classification'])
+                self.assertAlmostEqual(result['confidence'], expected['confidence'])
+                self.assertEqual(result['explanation'], expected['explanation'])
+    
+    def test_windowed_inference_aggregates_windows(self):
+        """Test window mode scores a bounded number of token windows."""
+        import torch
+        
+        tokenizer = MagicMock(model_max_length=512, model_input_names=['input_ids', 'attention_mask'])
+        tokenizer.return_value = {
+            'input_ids': torch.zeros((5, 8), dtype=torch.long),
+            'attention_mask': torch.ones((5, 8), dtype=torch.long),
+            'overflow_to_sample_mapping': torch.zeros(5, dtype=torch.long),
+        }
+        model = MagicMock()
+        model.config.id2label = {0: 'non-toxic', 1: 'toxic'}
+        model.return_value.logits = torch.tensor([[2.0, -2.0], [2.0, -2.0], [-2.0, 2.0]])
+        
+        self.guardian.classifier = MagicMock(tokenizer=tokenizer, model=model)
+        self.guardian.long_text = 'window'
+        self.guardian.max_windows = 3
+        
+        self.guardian.window_aggregation = 'max'
+        result = self.guardian.ai_classify("a very long email " * 500)
+        self.assertEqual(result['classification'], 'suspicious')
+        self.assertEqual(model.call_args.kwargs['input_ids'].shape[0], 3)
+        self.assertNotIn('overflow_to_sample_mapping', model.call_args.kwargs)
+        
+        self.guardian.window_aggregation = 'mean'
+        result = self.guardian.ai_classify("a very long email " * 500)
+        self.assertEqual(result['classification'], 'safe')
+    
+    def test_result_cache_hits_and_eviction(self):
+        """Test repeated bodies are served from the result cache."""
+        from email_guard import ResultCache
+        
+        self.guardian.cache = ResultCache(max_size=2, ttl=60)
+        email = "URGENT: verify now at http://login.tk/account"
+        
+        first = self.guardian.classify_email(email)
+        second = self.guardian.classify_email("  <b>urgent:</b>  VERIFY now at http://login.tk/account")
+        
+        self.assertEqual(first['suspicious_patterns'], second['suspicious_patterns'])
+        self.assertEqual(first['confidence'], second['confidence'])
+        self.assertGreaterEqual(second['processing_time'], 0)
+        self.assertEqual(self.guardian.cache.stats()['hits'], 1)
+        self.assertEqual(self.guardian.cache.stats()['misses'], 1)
+        
+        self.guardian.classify_batch(["one", "two", email])
+        stats = self.guardian.cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['evictions'], 1)
+    
+    def test_result_cache_ttl_expiry(self):
+        """Test cached results expire after the TTL."""
+        from email_guard import ResultCache
+        
+        cache = ResultCache(max_size=10, ttl=5)
+        with patch('email_guard.time.monotonic', return_value=100.0):
+            cache.put('key', {'patterns': []})
+            self.assertIsNotNone(cache.get('key'))
+        with patch('email_guard.time.monotonic', return_value=106.0):
+            self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.stats()['size'], 0)
+    
+    def test_background_model_loading(self):
+        """Test patterns serve while the model warms up on a thread."""
+        import threading
+        
+        release = threading.Event()
+        
+        def slow_pipeline(*args, **kwargs):
+            release.wait(5)
+            return MagicMock()
+        
+        with patch('email_guard.pipeline', side_effect=slow_pipeline):
+            guardian = EmailGuardian(model_loading='background')
+            self.assertEqual(guardian.model_status, 'loading')
+            
+            result = guardian.classify_email("URGENT: verify now")
+            self.assertIn('AI model not available', result['explanation'])
+            
+            release.set()
+            self.assertTrue(guardian.model_ready.wait(5))
+        
+        self.assertEqual(guardian.model_status, 'loaded')
+    
+    def test_pattern_only_loading_skips_model(self):
+        """Test model_loading='none' never builds a pipeline."""
+        with patch('email_guard.pipeline') as mock_pipeline:
+            guardian = EmailGuardian(model_loading='none')
+        
+        mock_pipeline.assert_not_called()
+        self.assertEqual(guardian.model_status, 'unavailable')
+    
+    def test_onnx_backend_falls_back_to_torch(self):
+        """Test a failing ONNX export/runtime falls back to the torch pipeline."""
+        with patch('onnx_backend.OnnxTextClassifier', side_effect=RuntimeError("no onnxruntime")), \
+                patch('email_guard.pipeline') as mock_pipeline:
+            guardian = EmailGuardian(inference_backend='onnx')
+        
+        mock_pipeline.assert_called_once()
+        self.assertEqual(guardian.active_backend, 'torch')
+        self.assertIsNotNone(guardian.classifier)
+    
+    def test_onnx_softmax_rows(self):
+        """Test ONNX logits are normalised row by row."""
+        import numpy as np
+        from onnx_backend import softmax
+        
+        probabilities = softmax(np.array([[0.0, 0.0], [1000.0, 0.0]]))
+        
+        np.testing.assert_allclose(probabilities.sum(axis=1), [1.0, 1.0])
+        self.assertAlmostEqual(probabilities[0, 1], 0.5)
+        self.assertAlmostEqual(probabilities[1, 0], 1.0)
+    
+    def test_onnx_rebuilds_corrupt_cached_graph(self):
+        """Test a corrupt cached ONNX graph is rebuilt instead of abandoned."""
+        try:
+            import onnx
+            from onnx import TensorProto, helper
+        except ImportError:
+            self.skipTest("onnx not installed")
+        from onnx_backend import MODEL_FILE, OnnxTextClassifier, model_cache_dir
+        
+        graph = helper.make_graph(
+            [helper.make_node('Cast', ['input_ids'], ['logits'], to=TensorProto.FLOAT)], 'tiny',
+            [helper.make_tensor_value_info('input_ids', TensorProto.INT64, ['batch', 2])],
+            [helper.make_tensor_value_info('logits', TensorProto.FLOAT, ['batch', 2])]
+        )
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            model_dir = model_cache_dir('tiny', tmp)
+            model_dir.mkdir(parents=True)
+            onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 14)]),
+                      str(model_dir / MODEL_FILE))
+            optimized_path = model_dir / 'model.optimized.onnx'
+            optimized_path.write_bytes(b'truncated')
+            
+            with patch('transformers.AutoTokenizer.from_pretrained', return_value=MagicMock(model_max_length=512)), \
+                    patch('transformers.AutoConfig.from_pretrained'):
+                classifier = OnnxTextClassifier('tiny', cache_dir=tmp)
+            
+            self.assertEqual(classifier.input_names, ['input_ids'])
+            self.assertGreater(optimized_path.stat().st_size, len(b'truncated'))
+            self.assertFalse([path.name for path in model_dir.iterdir() if path.name.endswith('.partial')])
+    
+    def test_quantize_model_converts_linear_layers(self):
+        """Test dynamic int8 quantization replaces linear layers."""
+        import torch
+        from model_quantization import quantize_model
+        
+        model = torch.nn.Sequential(torch.nn.Linear(8, 4), torch.nn.ReLU(), torch.nn.Linear(4, 2))
+        quantized = quantize_model(model)
+        
+        self.assertIn('quantized', type(quantized[0]).__module__)
+        self.assertEqual(quantized(torch.randn(3, 8)).shape, (3, 2))
+    
+    def test_quantized_model_cache_round_trip(self):
+        """Test the int8 cache stores plain tensors and reloads the same model."""
+        import torch
+        from pathlib import Path
+        from model_quantization import load_quantized_model, quantize_model, save_quantized_model
+        
+        def build():
+            return torch.nn.Sequential(torch.nn.Linear(8, 4), torch.nn.LayerNorm(4), torch.nn.Linear(4, 2))
+        
+        torch.manual_seed(0)
+        quantized = quantize_model(build())
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = Path(cache_dir) / "model" / "model.int8.safetensors"
+            save_quantized_model(quantized, path)
+            self.assertEqual(path.parent.stat().st_mode & 0o777, 0o700)
+            
+            reloaded = load_quantized_model(quantize_model(build()), path)
+            inputs = torch.randn(3, 8)
+            self.assertTrue(torch.equal(quantized(inputs), reloaded(inputs)))
+            
+            with self.assertRaises(ValueError):
+                load_quantized_model(quantize_model(torch.nn.Sequential(torch.nn.Linear(8, 2))), path)
+    
+    def test_quantization_agreement_report(self):
+        """Test the float/int8 agreement check counts label flips."""
+        from model_quantization import compare_predictions
+        
+        def float_classifier(texts, batch_size=None):
+            return [{'label': 'toxic', 'score': 0.9} for _ in texts]
+        
+        def int8_classifier(texts, batch_size=None):
+            return [{'label': 'toxic' if i else 'non-toxic', 'score': 0.8} for i, _ in enumerate(texts)]
+        
+        report = compare_predictions(float_classifier, int8_classifier, ["a", "b", "c", "d"])
+        
+        self.assertEqual(report['samples'], 4)
+        self.assertAlmostEqual(report['agreement_rate'], 0.75)
+        self.assertEqual(len(report['disagreements']), 1)
+        self.assertAlmostEqual(report['max_score_delta'], 0.7)
+    
+    def test_cascade_skips_model_when_patterns_decide(self):
+        """Test cascade mode only calls the model for undecided emails."""
+        self.guardian.classifier = MagicMock(return_value=[{'label': 'toxic', 'score': 0.9}])
+        self.guardian.cascade = True
+        
+        spam = "URGENT!!! dear customer, verify now: your credit card and bank account are locked"
+        result = self.guardian.classify_email(spam)
+        
+        self.guardian.classifier.assert_not_called()
+        self.assertEqual(result['analysis_path'], 'cascade')
+        self.assertEqual(result['classification'], 'suspicious')
+        self.assertEqual(result['risk_level'], 'high')
+        
+        result = self.guardian.classify_email("see you at the meeting")
+        
+        self.guardian.classifier.assert_called_once()
+        self.assertEqual(result['analysis_path'], 'ai+patterns')
+    
+    def test_cascade_decisiveness(self):
+        """Test which pattern outcomes the cascade treats as decisive."""
+        few_hits = {'confidence': 0.6, 'rule_ids': ('urgent_action',)}
+        many_hits = {'confidence': 0.8, 'rule_ids': ('urgent_action', 'verify_now', 'financial')}
+        no_hits = {'confidence': 0.7, 'rule_ids': ()}
+        
+        self.assertTrue(self.guardian.is_decisive(many_hits))
+        self.assertFalse(self.guardian.is_decisive(few_hits))
+        self.assertFalse(self.guardian.is_decisive(no_hits))
+        
+        # Without the rule-hit shortcut no score is decisive under 0.7/0.3
+        self.guardian.cascade_min_matches = 0
+        self.assertFalse(self.guardian.is_decisive(many_hits))
+        
+        self.guardian.AI_WEIGHT = 0.3
+        self.guardian.PATTERN_WEIGHT = 0.7
+        self.assertTrue(self.guardian.is_decisive(many_hits))
+        
+        with self.assertRaises(ValueError):
+            EmailGuardian(model_loading='none', cascade_min_matches=-1)
+    
+    def test_bulk_readers_stream_messages(self):
+        """Test mbox and Maildir inputs yield raw messages and JSONL yields texts."""
+        from bulk_scan import iter_messages
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            mbox_path = os.path.join(tmp, 'inbox.mbox')
+            with open(mbox_path, 'w') as f:
+                f.write("From a@example.com Mon Jan  1 00:00:00 2024\n"
+                        "Subject: Verify now\n\nYour account is locked.\n>From the bank\n\n"
+                        "From b@example.com Mon Jan  1 00:00:00 2024\n"
+                        "Subject: Lunch\n\nSee you at noon.\n")
+            messages = list(iter_messages(mbox_path))
+            self.assertEqual(len(messages), 2)
+            self.assertIn(b"Subject: Verify now", messages[0][1])
+            self.assertIn(b"\nFrom the bank", messages[0][1])
+            self.assertIn(b"See you at noon.", messages[1][1])
+            
+            maildir = os.path.join(tmp, 'Maildir')
+            for folder in ('cur', 'new', 'tmp'):
+                os.makedirs(os.path.join(maildir, folder))
+            with open(os.path.join(maildir, 'new', '1.eml'), 'w') as f:
+                f.write("Subject: Hello\n\nPlain body\n")
+            self.assertEqual(list(iter_messages(maildir)), [('new/1.eml', b"Subject: Hello\n\nPlain body\n")])
+            
+            jsonl_path = os.path.join(tmp, 'emails.jsonl')
+            with open(jsonl_path, 'w') as f:
+                f.write('{"id": "m1", "email_text": "first"}\n\n"second"\n{"body": "third"}\n')
+            self.assertEqual(list(iter_messages(jsonl_path)), [('m1', 'first'), ('3', 'second'), ('4', 'third')])
+    
+    def test_bulk_scan_writes_ndjson(self):
+        """Test streamed results are written as one JSON line per message."""
+        import io
+        from bulk_scan import scan_stream
+        
+        messages = ((str(i), "URGENT: verify now" if i % 2 else "hello") for i in range(5))
+        out = io.StringIO()
+        
+        with patch.object(self.guardian, 'classify_batch', wraps=self.guardian.classify_batch) as batch:
+            summary = scan_stream(self.guardian, messages, out, batch_size=2)
+        
+        self.assertEqual(batch.call_count, 3)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record['id'] for record in records], ['0', '1', '2', '3', '4'])
+        self.assertIn('classification', records[0])
+        self.assertEqual(summary['messages'], 5)
+        self.assertEqual(sum(summary['classifications'].values()), 5)
+    
+    def test_bulk_scan_checks_raw_message_parts(self):
+        """Test mbox messages are scored part by part with one batched model call."""
+        import io
+        from bulk_scan import iter_messages, scan_stream
+        
+        self.guardian.classifier = MagicMock(side_effect=lambda texts, batch_size: [
+            {'label': 'non-toxic', 'score': 0.9} for _ in texts
+        ])
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            mbox_path = os.path.join(tmp, 'inbox.mbox')
+            with open(mbox_path, 'w') as f:
+                f.write("From a@example.com Mon Jan  1 00:00:00 2024\n"
+                        "From: Billing <billing@invoices.tk>\nSubject: Invoice\n"
+                        "MIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=XX\n\n"
+                        "--XX\nContent-Type: text/plain\n\nPlease see the attached invoice.\n"
+                        "--XX\nContent-Type: application/octet-stream\n"
+                        "Content-Disposition: attachment; filename=\"invoice.exe\"\n\nTVqQ\n--XX--\n\n"
+                        "From b@example.com Mon Jan  1 00:00:00 2024\n"
+                        "From: Alice <alice@example.com>\nSubject: Lunch\n\nSee you at noon.\n")
+            
+            out = io.StringIO()
+            with patch.object(self.guardian, 'classify_raw_batch',
+                              wraps=self.guardian.classify_raw_batch) as raw_batch:
+                scan_stream(self.guardian, iter_messages(mbox_path), out, batch_size=2)
+        
+        raw_batch.assert_called_once()
+        self.guardian.classifier.assert_called_once()
+        model_texts = self.guardian.classifier.call_args[0][0]
+        self.assertEqual(len(model_texts), 2)
+        self.assertFalse(any('invoice.exe' in text or 'TVqQ' in text for text in model_texts))
+        
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertIn('dangerous_attachment', records[0]['rule_ids'])
+        self.assertIn('sender_suspicious_tld', records[0]['rule_ids'])
+        self.assertNotIn('dangerous_attachment', records[1]['rule_ids'])
+        self.assertNotIn('sender_suspicious_tld', records[1]['rule_ids'])
+    
+    def test_process_pool_matches_serial_results(self):
+        """Test forked workers return the serial results in input order."""
+        import multiprocessing
+        from process_pool import GuardianProcessPool
+        
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest("fork start method not available")
+        
+        texts = [f"message {i}: " + ("URGENT verify now" if i % 3 == 0 else "see you soon") for i in range(10)]
+        expected = self.guardian.classify_batch(texts)
+        
+        with GuardianProcessPool(self.guardian, workers=2) as pool:
+            self.assertGreaterEqual(pool.torch_threads, 1)
+            results = pool.classify_batch(texts, batch_size=3)
+        
+        self.assertEqual(
+            [(r['classification'], r['confidence'], r['suspicious_patterns']) for r in results],
+            [(r['classification'], r['confidence'], r['suspicious_patterns']) for r in expected]
+        )
+    
+    def test_benchmark_reports_stages_and_flags_regressions(self):
+        """Test the benchmark times every stage and compares against a baseline."""
+        from benchmark import STAGES, compare, generate_corpus, percentile, run_benchmark
+        
+        corpus = generate_corpus(12, seed=1, sizes=(200, 2000))
+        self.assertEqual(corpus, generate_corpus(12, seed=1, sizes=(200, 2000)))
+        self.assertEqual({item['kind'] for item in corpus}, {'clean', 'spam', 'phishing'})
+        self.assertAlmostEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertAlmostEqual(percentile([0, 10], 95), 9.5)
+        
+        report = run_benchmark(self.guardian, corpus, warmup=2)
+        self.assertEqual(set(report['stages']), set(STAGES))
+        self.assertEqual(report['meta']['messages'], 12)
+        self.assertGreater(report['messages_per_second'], 0)
+        self.assertEqual(compare(report, report), [])
+        
+        slower = json.loads(json.dumps(report))
+        slower['stages']['pattern_classify']['p95_ms'] = report['stages']['pattern_classify']['p95_ms'] * 2 + 1
+        regressions = compare(slower, report, threshold=0.1)
+        self.assertEqual([(r['stage'], r['metric']) for r in regressions], [('pattern_classify', 'p95_ms')])
+    
+    def test_stage_timings_and_hooks(self):
+        """Test per-stage timings reach results behind the flag and every hook."""
+        from stage_metrics import StageLatencyStats
+        
+        stats = StageLatencyStats(window=10)
+        calls = []
+        self.guardian.add_timing_hook(stats)
+        self.guardian.add_timing_hook(lambda timings, result: calls.append(timings))
+        
+        result = self.guardian.classify_email("URGENT: verify now at http://login.tk/account")
+        self.assertNotIn('stage_timings', result)
+        self.assertEqual(set(calls[0]), {'preprocess', 'patterns', 'ai', 'combine'})
+        self.assertAlmostEqual(sum(calls[0].values()), result['processing_time'], places=3)
+        
+        self.guardian.stage_timings = True
+        raw = "From: a@example.com\nSubject: hi\n\nsee you soon"
+        result = self.guardian.classify_raw_email(raw)
+        self.assertEqual(set(result['stage_timings']), {'parse', 'preprocess', 'patterns', 'ai', 'combine'})
+        self.assertTrue(all(seconds >= 0 for seconds in result['stage_timings'].values()))
+        
+        batch = self.guardian.classify_batch(["one", "two"])
+        self.assertEqual(batch[0]['stage_timings'], batch[1]['stage_timings'])
+        self.assertEqual(len(calls), 4)
+        
+        # A failing sink does not fail the classification
+        self.guardian.add_timing_hook(lambda timings, result: 1 / 0)
+        self.guardian.classify_email("hello")
+        summary = stats.summary()
+        self.assertEqual(summary['patterns']['count'], 5)
+        self.assertEqual(summary['parse']['count'], 1)
+        self.assertLessEqual(summary['total']['p50_ms'], summary['total']['p99_ms'])
+    
+    def test_cpu_tuning_settings(self):
+        """Test thread/affinity settings and auto-tune candidate selection."""
+        from cpu_tuning import autotune, candidate_settings, cpu_ids, parse_cpu_list, worker_cpus
+        import email_guard
+        
+        self.assertEqual(parse_cpu_list("0-2, 5"), [0, 1, 2, 5])
+        with self.assertRaises(ValueError):
+            parse_cpu_list("3-1")
+        self.assertEqual(worker_cpus(1, 2, [0, 1, 2, 3]), [2, 3])
+        self.assertEqual(worker_cpus(2, 3, [0, 1]), [0])
+        
+        # Sibling workers claim distinct slots until all are taken
+        from cpu_tuning import claim_worker_slot
+        with tempfile.TemporaryDirectory() as lock_dir:
+            slots = [claim_worker_slot(2, "test", lock_dir) for _ in range(3)]
+        if slots[0] is not None:
+            self.assertEqual(slots, [0, 1, None])
+        
+        settings = candidate_settings(8, max_workers=4)
+        self.assertIn((1, 8, 1), settings)
+        self.assertIn((4, 2, 1), settings)
+        self.assertTrue(all(workers * threads <= 8 for workers, threads, _ in settings))
+        
+        def fake_trial(options, texts, workers, intra, inter, batch_size, pin):
+            return {'workers': workers, 'intra_op_threads': intra, 'inter_op_threads': inter,
+                    'messages_per_second': 100.0 * workers + intra}
+        report = autotune({}, ["hi"], [(1, 4, 1), (2, 2, 1), (4, 1, 1)], trial=fake_trial, out=MagicMock())
+        self.assertEqual(report['best']['workers'], 4)
+        
+        with self.assertRaises(ValueError):
+            EmailGuardian(model_loading='none', intra_op_threads=-1)
+        
+        threads = email_guard.torch.get_num_threads() if email_guard.torch else None
+        try:
+            with patch('email_guard.pipeline') as mock_pipeline:
+                mock_pipeline.return_value = MagicMock()
+                guardian = EmailGuardian(intra_op_threads=1, cpu_affinity=",".join(map(str, cpu_ids())))
+            self.assertEqual(guardian.cpu_affinity, cpu_ids())
+            self.assertEqual(email_guard.torch.get_num_threads(), 1)
+        finally:
+            if threads:
+                email_guard.torch.set_num_threads(threads)
+    
+    def test_rule_pack_reload_swaps_snapshot(self):
+        """Test rule packs load from files and hot-swap when the file changes."""
+        from rule_pack import DEFAULT_RULE_PACK, RulePackError, RulePackWatcher, compile_rule_pack
+        
+        result = self.guardian.classify_email("URGENT: verify now")
+        self.assertEqual(result['rule_pack_version'], DEFAULT_RULE_PACK['version'])
+        self.assertEqual(len(self.guardian.phishing_patterns) + len(self.guardian.spam_patterns),
+                         len(DEFAULT_RULE_PACK['rules']))
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rules.json')
+            pack = {'version': 'campaign-1', 'rules': [
+                {'id': 'gift_card', 'category': 'phishing', 'pattern': r'\b(gift cards?)\b'},
+                {'id': 'url_tld', 'category': 'phishing', 'pattern': r'https?://\S+\.tk', 'check': 'suspicious_tld'},
+            ]}
+            with open(path, 'w') as f:
+                json.dump(pack, f)
+            
+            self.assertEqual(compile_rule_pack(path).version, 'campaign-1')
+            watcher = RulePackWatcher(path, self.guardian.swap_rules)
+            self.assertFalse(watcher.check())
+            
+            pack['version'] = 'campaign-2'
+            with open(path, 'w') as f:
+                json.dump(pack, f, indent=1)
+            self.assertTrue(watcher.check())
+            result = self.guardian.classify_email("Buy gift cards at http://shop.tk/now, URGENT")
+            self.assertEqual(result['rule_pack_version'], 'campaign-2')
+            self.assertEqual(len(result['suspicious_patterns']), 2)
+            
+            # A broken update keeps the active snapshot
+            with open(path, 'w') as f:
+                f.write('{"rules": [{"id": "bad", "category": "phishing", "pattern": "(unclosed"}]}')
+            self.assertFalse(watcher.check())
+            self.assertEqual(self.guardian.rules.version, 'campaign-2')
+            with self.assertRaises(RulePackError):
+                compile_rule_pack(path)
+            
+            try:
+                import yaml
+            except ImportError:
+                return
+            yaml_path = os.path.join(tmp, 'rules.yaml')
+            with open(yaml_path, 'w') as f:
+                yaml.safe_dump(DEFAULT_RULE_PACK, f)
+            guardian = EmailGuardian(model_loading='none', rule_pack_file=yaml_path)
+            self.assertEqual(guardian.rules.rule_ids, compile_rule_pack().rule_ids)
+    
+    def test_slotted_results_carry_rule_ids(self):
+        """Test stage results are slotted and report rule ids with separate descriptions."""
+        from results import DENY_LIST_ID, AIResult, PatternResult
+        
+        text = self.guardian.preprocess_text("URGENT: dear customer, visit http://login.tk/verify")
+        pattern_result = self.guardian.pattern_classify(text)
+        self.assertIsInstance(pattern_result, PatternResult)
+        self.assertFalse(hasattr(pattern_result, '__dict__'))
+        self.assertEqual(pattern_result.rule_ids, ('urgency', 'url_suspicious_tld', 'generic_greeting', 'all_caps'))
+        self.assertEqual(pattern_result['confidence'], pattern_result.confidence)
+        
+        ai_result = self.guardian.ai_classify(text)
+        self.assertIsInstance(ai_result, AIResult)
+        self.assertEqual(ai_result['classification'], 'unknown')
+        
+        result = self.guardian.classify_email("URGENT: dear customer, visit http://login.tk/verify")
+        self.assertEqual(result['rule_ids'], list(pattern_result.rule_ids))
+        self.assertEqual(result['suspicious_patterns'],
+                         [self.guardian.rules.descriptions[rule_id] for rule_id in result['rule_ids']])
+        json.dumps(result)
+        
+        self.guardian.url_index.deny_domains.add('evil-login.com')
+        result = self.guardian.classify_email("see http://secure.evil-login.com/x")
+        self.assertEqual(result['rule_ids'][-1], DENY_LIST_ID)
+        self.assertEqual(result['suspicious_patterns'][-1], "Phishing domain: secure.evil-login.com (deny-list)")
+        self.assertEqual(len(result['suspicious_patterns']), len(result['rule_ids']))
 
 
 class TestDatabase(unittest.TestCase):
@@ -146,10 +855,12 @@ class TestDatabase(unittest.TestCase):
     
     def tearDown(self):
         """Clean up test database."""
-        try:
-            os.unlink(self.db_file.name)
-        except:
-            pass
+        self.db.close()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.unlink(self.db_file.name + suffix)
+            except:
+                pass
     
     def test_database_initialization(self):
         """Test database tables are created."""
@@ -206,6 +917,208 @@ class TestDatabase(unittest.TestCase):
         # Test invalid key
         is_invalid = self.db.verify_api_key("invalid-key")
         self.assertFalse(is_invalid)
+    
+    def test_api_key_cache_and_batched_last_used(self):
+        """Test cached verification skips the database and last_used is flushed in a batch."""
+        api_key = self.db.create_api_key("Cached Key")
+        other_key = self.db.create_api_key("Other Key")
+        self.assertTrue(self.db.verify_api_key(api_key))
+        self.assertTrue(self.db.verify_api_key(other_key))
+        
+        def last_used():
+            return dict(self.db.connection().execute("SELECT name, last_used FROM api_keys"))
+        
+        # Verification alone writes nothing
+        self.assertEqual(last_used(), {"Cached Key": None, "Other Key": None})
+        
+        with patch.object(self.db, 'connection', side_effect=AssertionError("database used")):
+            for _ in range(3):
+                self.assertTrue(self.db.verify_api_key(api_key))
+        
+        self.assertEqual(self.db.flush_last_used(), 2)
+        self.assertEqual(self.db.flush_last_used(), 0)
+        self.assertTrue(all(last_used().values()))
+        
+        # Deactivation takes effect immediately despite the cache
+        key_id = self.db.connection().execute(
+            "SELECT key_id FROM api_keys WHERE name = 'Cached Key'").fetchone()[0]
+        self.assertTrue(self.db.deactivate_api_key(key_id))
+        self.assertFalse(self.db.verify_api_key(api_key))
+        self.assertTrue(self.db.verify_api_key(other_key))
+        self.assertFalse(self.db.deactivate_api_key("missing"))
+    
+    def test_deactivation_racing_verification_is_not_cached(self):
+        """Test a verify that read the key before it was deactivated does not cache it."""
+        api_key = self.db.create_api_key("Racing Key")
+        key_id = self.db.connection().execute(
+            "SELECT key_id FROM api_keys WHERE name = 'Racing Key'").fetchone()[0]
+        lookup = self.db._lookup_key
+        
+        def deactivated_after_lookup(key_hash):
+            active = lookup(key_hash)
+            self.db.deactivate_api_key(key_id)
+            return active
+        
+        with patch.object(self.db, '_lookup_key', side_effect=deactivated_after_lookup):
+            self.assertTrue(self.db.verify_api_key(api_key))
+        self.assertFalse(self.db.verify_api_key(api_key))
+    
+    def test_pooled_connections_use_wal(self):
+        """Test each thread reuses one WAL connection that survives failed writes."""
+        import threading
+        
+        conn = self.db.connection()
+        self.assertIs(self.db.connection(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+        
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.db.connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+        
+        scan_data = {
+            'scan_id': 'dup', 'email_text_hash': 'h', 'classification': 'safe', 'confidence': 0.1,
+            'explanation': '', 'risk_level': 'low', 'suspicious_patterns': [],
+            'timestamp': '2024-01-01T12:00:00', 'processing_time_ms': 1
+        }
+        self.db.save_scan_result(scan_data)
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.save_scan_result(scan_data)
+        self.assertFalse(conn.in_transaction)
+        self.db.save_scan_result(dict(scan_data, scan_id='next'))
+        self.assertEqual(len(self.db.get_scan_history(limit=10)), 2)
+        
+        self.db.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+        self.db.ping()
+    
+    def test_scan_writer_batches_and_drains(self):
+        """Test the write-behind queue batches inserts and loses nothing on close."""
+        from app import ScanWriter
+        
+        def record(i):
+            return {
+                'scan_id': f'scan-{i}', 'email_text_hash': 'h', 'classification': 'safe',
+                'confidence': 0.1, 'explanation': '', 'risk_level': 'low',
+                'suspicious_patterns': [], 'timestamp': f'2024-01-01T12:00:{i:02d}',
+                'processing_time_ms': 1
+            }
+        
+        writer = ScanWriter(self.db, batch_size=3, flush_interval=60)
+        with patch.object(self.db, 'save_scan_results', wraps=self.db.save_scan_results) as save:
+            for i in range(4):
+                writer.submit(record(i))
+            writer.flush()
+            self.assertEqual([len(call.args[0]) for call in save.call_args_list], [3, 1])
+            self.assertEqual(len(self.db.get_scan_history(limit=100)), 4)
+            
+            # A duplicate fails its batch; the other records are still saved
+            writer.submit(record(0))
+            for i in range(4, 8):
+                writer.submit(record(i))
+            writer.close()
+        
+        self.assertEqual(len(self.db.get_scan_history(limit=100)), 8)
+        self.assertEqual(writer.stats()['written'], 8)
+        self.assertEqual(writer.stats()['failed'], 1)
+        self.assertEqual(writer.stats()['pending'], 0)
+        
+        # After close, records are handed back to the caller
+        self.assertFalse(writer.submit(record(8)))
+        writer.write([record(8)])
+        self.assertEqual(len(self.db.get_scan_history(limit=100)), 9)
+    
+    def test_scan_writer_full_queue_does_not_block(self):
+        """Test submit refuses at once when the queue is full instead of blocking."""
+        import threading
+        import time
+        from app import ScanWriter
+        
+        def record(i):
+            return {
+                'scan_id': f'scan-{i}', 'email_text_hash': 'h', 'classification': 'safe',
+                'confidence': 0.1, 'explanation': '', 'risk_level': 'low',
+                'suspicious_patterns': [], 'timestamp': '2024-01-01T12:00:00',
+                'processing_time_ms': 1
+            }
+        
+        gate = threading.Event()
+        save = self.db.save_scan_results
+        
+        def slow_save(records):
+            gate.wait(5)
+            save(records)
+        
+        writer = ScanWriter(self.db, batch_size=1, flush_interval=60, max_queue=1)
+        with patch.object(self.db, 'save_scan_results', side_effect=slow_save):
+            self.assertTrue(writer.submit(record(0)))
+            deadline = time.monotonic() + 5
+            while writer.stats()['pending'] and time.monotonic() < deadline:
+                time.sleep(0.01)  # the writer takes it and stalls in the insert
+            self.assertTrue(writer.submit(record(1)))
+            
+            start = time.perf_counter()
+            self.assertFalse(writer.submit(record(2)))
+            self.assertLess(time.perf_counter() - start, 0.05)
+            self.assertEqual(writer.stats()['overflows'], 1)
+            
+            # flush neither blocks on the full queue nor waits forever
+            start = time.perf_counter()
+            self.assertFalse(writer.flush(timeout=0.1))
+            self.assertLess(time.perf_counter() - start, 1.0)
+            
+            gate.set()
+            self.assertTrue(writer.flush(timeout=5))
+            writer.write([record(2)])
+            writer.close()
+        
+        self.assertEqual(len(self.db.get_scan_history(limit=10)), 3)
+    
+    def test_history_keyset_pagination(self):
+        """Test cursor pages match offset pages and are served from the index."""
+        from app import decode_history_cursor, encode_history_cursor
+        
+        records = [
+            {
+                'scan_id': f'scan-{i:02d}', 'user_id': 'u1' if i % 3 else 'u2',
+                'email_text_hash': 'h', 'classification': 'safe', 'confidence': 0.1,
+                'explanation': '', 'risk_level': 'low', 'suspicious_patterns': [],
+                # Pairs of scans share a timestamp
+                'timestamp': f'2024-01-01T12:00:{i // 2:02d}', 'processing_time_ms': 1
+            }
+            for i in range(25)
+        ]
+        self.db.save_scan_results(records)
+        
+        conn = self.db.connection()
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], Database.SCHEMA_VERSION)
+        
+        for user_id in (None, 'u1'):
+            by_offset = self.db.get_scan_history(user_id, limit=100)
+            pages, after = [], None
+            while True:
+                page = self.db.get_scan_history(user_id, limit=4, after=after)
+                pages.extend(page)
+                if len(page) < 4:
+                    break
+                token = encode_history_cursor(page[-1]['timestamp'], page[-1]['scan_id'])
+                after = decode_history_cursor(token)
+            self.assertEqual(pages, by_offset)
+            self.assertEqual(by_offset[0]['scan_id'], 'scan-23' if user_id else 'scan-24')
+        
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT scan_id FROM scan_history WHERE user_id = ? "
+            "AND (timestamp, scan_id) < (?, ?) ORDER BY timestamp DESC, scan_id DESC LIMIT 10",
+            ('u1', '2024-01-01T12:00:05', 'scan-10')
+        ).fetchall()
+        self.assertIn('idx_scan_history_user_time', str(plan))
+        self.assertNotIn('TEMP B-TREE', str(plan))
+        
+        with self.assertRaises(ValueError):
+            decode_history_cursor('not-a-cursor')
 
 
 class TestAPI(unittest.TestCase):
@@ -241,6 +1154,7 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         data = response.json()
         self.assertIn("status", data)
+        self.assertIn("ai_model_status", data)
     
     @patch('app.db')
     def test_create_api_key(self, mock_db):
@@ -283,6 +1197,37 @@ class TestAPI(unittest.TestCase):
         self.assertIn("confidence", data)
         self.assertIn("scan_id", data)
     
+    def test_scan_inference_runs_off_loop_with_bounded_queue(self):
+        """Test classification runs on inference threads and overload returns 503."""
+        import asyncio
+        import threading
+        from app import InferenceExecutor
+        
+        executor = InferenceExecutor(workers=1, max_queue=0)
+        try:
+            thread_name = asyncio.run(executor.run(lambda: threading.current_thread().name))
+            self.assertTrue(thread_name.startswith('inference'))
+            self.assertEqual(executor.stats()['completed'], 1)
+            
+            # The only worker is busy and nothing may wait
+            executor.in_flight = 1
+            executor.average_seconds = 2.5
+            with patch('app.db') as mock_db, patch('app.inference', executor), \
+                    patch('app.email_guardian') as mock_guardian:
+                mock_db.verify_api_key.return_value = True
+                response = self.client.post("/scan",
+                    json={"email_text": "Test email"},
+                    headers={"Authorization": f"Bearer {self.api_key}"}
+                )
+            
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers.get("Retry-After"), "3")
+            mock_guardian.classify_email.assert_not_called()
+            self.assertEqual(executor.stats()['rejected'], 1)
+            executor.in_flight = 0
+        finally:
+            executor.close()
+    
     @patch('app.db')
     def test_scan_without_api_key(self, mock_db):
         """Test scanning without API key returns 401."""
@@ -339,6 +1284,24 @@ class TestAPI(unittest.TestCase):
         data = response.json()
         self.assertIn("history", data)
         self.assertEqual(len(data["history"]), 1)
+    
+    @patch('app.db')
+    def test_get_history_rejects_offset_with_cursor(self, mock_db):
+        """Test offset and after cannot be combined, since both would skip rows."""
+        from app import encode_history_cursor
+        mock_db.verify_api_key.return_value = True
+        mock_db.get_scan_history.return_value = []
+        after = encode_history_cursor('2024-01-01T12:00:00', 'test-123')
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        
+        response = self.client.get("/history", params={"after": after, "offset": 10}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        mock_db.get_scan_history.assert_not_called()
+        
+        response = self.client.get("/history", params={"after": after}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        mock_db.get_scan_history.assert_called_once_with(
+            None, 10, 0, after=('2024-01-01T12:00:00', 'test-123'))
 
 
 class TestSecurity(unittest.TestCase):